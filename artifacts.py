@@ -0,0 +1,375 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from packaging.tags import sys_tags
+from packaging.utils import canonicalize_name, parse_sdist_filename, parse_wheel_filename
+from packaging.version import InvalidVersion, Version
+
+from index import normalize
+
+logger = logging.getLogger()
+
+DEFAULT_ARTIFACT_DIR = "./cache/artifacts/"
+DEFAULT_MAX_BYTES = 50 * 1024 ** 3
+# How long an unpinned requirement ("aenum") keeps resolving to the files
+# downloaded for it; exact pins ("aenum==3.1.15") never expire
+REQUIREMENT_TTL = 24 * 3600
+# Artifacts used more recently than this are never evicted, so a file cannot
+# disappear between being fetched and being linked into a work directory
+EVICT_GRACE = 3600
+PIP_TIMEOUT = 600
+DEFAULT_INDEX_URL = "https://pypi.org/simple/"
+# Concurrent downloads per fetch_many call
+DOWNLOAD_THREADS = 8
+HTTP_TIMEOUT = 60
+# Prefer the PEP 691 JSON project pages, fall back to the PEP 503 HTML ones
+SIMPLE_ACCEPT = "application/vnd.pypi.simple.v1+json, application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.01"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    sha256 TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (sha256, filename)
+);
+CREATE INDEX IF NOT EXISTS artifacts_last_used ON artifacts (last_used);
+CREATE TABLE IF NOT EXISTS requirements (
+    requirement TEXT NOT NULL,
+    index_url TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    project TEXT
+);
+CREATE INDEX IF NOT EXISTS requirements_key ON requirements (requirement, index_url);
+"""
+
+PINNED_RE = re.compile(r"^[A-Za-z0-9._-]+(\[[^\]]*\])?===?[^,;<>!~=*]+$")
+PIN_RE = re.compile(r"^([A-Za-z0-9._-]+)(?:\[[^\]]*\])?===?([^,;<>!~=*\s]+)$")
+PROJECT_RE = re.compile(r"^\s*([A-Za-z0-9._-]+)")
+ANCHOR_RE = re.compile(r"<a\s+([^>]*)>([^<]*)</a>", re.IGNORECASE)
+HREF_RE = re.compile(r'href="([^"]*)"', re.IGNORECASE)
+
+# Wheel tags supported by this interpreter, best first, as pip download ranks them
+TAG_PRIORITY = { tag: i for i, tag in enumerate(sys_tags()) }
+
+
+http_local = threading.local()
+
+
+def http_session():
+    # One keep-alive session per thread, reused for every index and file request
+    session = getattr(http_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=DOWNLOAD_THREADS)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        http_local.session = session
+    return session
+
+
+def project_files(index_url, name):
+    """List the files of a project on a simple index as dicts with filename, url, sha256 and yanked."""
+    url = urllib.parse.urljoin(index_url.rstrip("/") + "/", canonicalize_name(name) + "/")
+    response = http_session().get(url, headers={"Accept": SIMPLE_ACCEPT}, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    files = []
+    if "json" in response.headers.get("Content-Type", ""):
+        for x in response.json()["files"]:
+            files.append({
+                "filename": x["filename"],
+                "url": urllib.parse.urljoin(url, x["url"]),
+                "sha256": x.get("hashes", {}).get("sha256"),
+                "yanked": bool(x.get("yanked")),
+            })
+        return files
+    for attrs, text in ANCHOR_RE.findall(response.text):
+        href = HREF_RE.search(attrs)
+        if href is None:
+            continue
+        link, _, fragment = href.group(1).replace("&amp;", "&").partition("#")
+        sha256 = fragment[len("sha256="):] if fragment.startswith("sha256=") else None
+        files.append({
+            "filename": text.strip(),
+            "url": urllib.parse.urljoin(url, link),
+            "sha256": sha256,
+            "yanked": "data-yanked" in attrs,
+        })
+    return files
+
+
+def pick_file(files, name, version):
+    """Pick the file pip download would choose for name==version: the best supported wheel, else the sdist."""
+    name = canonicalize_name(name)
+    try:
+        version = Version(version)
+    except InvalidVersion:
+        return None
+    best = None
+    sdist = None
+    for x in files:
+        if x["yanked"] or not x["sha256"]:
+            continue
+        try:
+            if x["filename"].endswith(".whl"):
+                fname, fversion, _, tags = parse_wheel_filename(x["filename"])
+                if fname != name or fversion != version:
+                    continue
+                rank = min((TAG_PRIORITY[t] for t in tags if t in TAG_PRIORITY), default=None)
+                if rank is not None and (best is None or rank < best[0]):
+                    best = (rank, x)
+            else:
+                fname, fversion = parse_sdist_filename(x["filename"])
+                if fname == name and fversion == version:
+                    sdist = x
+        except ValueError:
+            continue
+    return best[1] if best is not None else sdist
+
+
+def requirement_project(requirement):
+    """Normalized name of the project a requirement is for, e.g. "foo-bar" for "Foo_Bar==1.0"."""
+    m = PROJECT_RE.match(requirement)
+    return None if m is None else normalize(m.group(1))
+
+
+def sha256_file(fpath):
+    h = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy(src, dst)
+
+
+class ArtifactStore:
+    """Content-addressed store of downloaded wheels and sdists shared by all analyzers.
+
+    Files live in <root>/objects/<sha256[:2]>/<sha256>/<filename>. A SQLite
+    index maps requirements to the files pip downloaded for them and tracks
+    the size and last use of every file, so the store can be kept under a
+    size cap by evicting the least recently used artifacts.
+    """
+
+    def __init__(self, root=DEFAULT_ARTIFACT_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        self.db_path = os.path.join(self.root, "index.db")
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            self._add_project_column(conn)
+
+    def _add_project_column(self, conn):
+        # Stores created before requirements had their normalized project name
+        columns = [ x[1] for x in conn.execute("PRAGMA table_info(requirements)") ]
+        if "project" not in columns:
+            try:
+                conn.execute("ALTER TABLE requirements ADD COLUMN project TEXT")
+            except sqlite3.OperationalError:
+                # Added by another process in the meantime
+                pass
+        rows = conn.execute("SELECT DISTINCT requirement FROM requirements WHERE project IS NULL").fetchall()
+        conn.executemany("UPDATE requirements SET project = ? WHERE requirement = ?", [ (requirement_project(x), x) for x, in rows ])
+        conn.execute("CREATE INDEX IF NOT EXISTS requirements_project ON requirements (project, index_url, fetched_at)")
+
+    def _connect(self):
+        # One short-lived connection per operation, so the store can be used
+        # from several threads and processes at once
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def path(self, sha256, filename):
+        return os.path.join(self.root, "objects", sha256[:2], sha256, filename)
+
+    def add(self, fpath, filename=None, sha256=None):
+        """Move a downloaded file into the store and return its stored path."""
+        filename = filename or os.path.basename(fpath)
+        sha256 = sha256 or sha256_file(fpath)
+        dest = self.path(sha256, filename)
+        if os.path.exists(dest):
+            os.remove(fpath)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(fpath, dest)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (sha256, filename, size, last_used) VALUES (?, ?, ?, ?)",
+                (sha256, filename, os.path.getsize(dest), time.time()),
+            )
+        return dest
+
+    def lookup(self, requirement, index_url):
+        """Return the stored paths for a requirement, or None if it has to be downloaded."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT sha256, filename, fetched_at FROM requirements WHERE requirement = ? AND index_url = ?",
+                (requirement, index_url),
+            ).fetchall()
+            if not rows:
+                return None
+            if not PINNED_RE.match(requirement) and min(x[2] for x in rows) < time.time() - REQUIREMENT_TTL:
+                return None
+            paths = [ self.path(sha256, filename) for sha256, filename, _ in rows ]
+            if not all(os.path.exists(x) for x in paths):
+                return None
+            conn.executemany(
+                "UPDATE artifacts SET last_used = ? WHERE sha256 = ? AND filename = ?",
+                [ (time.time(), sha256, filename) for sha256, filename, _ in rows ],
+            )
+        return paths
+
+    def lookup_project(self, name, index_url):
+        """Return the stored paths of the most recently fetched release of a project, whatever the requirement was."""
+        paths = self.lookup(name, index_url)
+        if paths is not None:
+            return paths
+        with self._connect() as conn:
+            # By PEP 503 normalized name, so "Foo_Bar" finds what was fetched for "foo-bar==1.0"
+            row = conn.execute(
+                "SELECT requirement FROM requirements WHERE project = ? AND index_url = ? AND requirement LIKE '%==%' ORDER BY fetched_at DESC LIMIT 1",
+                (normalize(name), index_url),
+            ).fetchone()
+        return None if row is None else self.lookup(row[0], index_url)
+
+    def remember(self, requirement, index_url, paths):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM requirements WHERE requirement = ? AND index_url = ?", (requirement, index_url))
+            conn.executemany(
+                "INSERT INTO requirements (requirement, index_url, sha256, filename, fetched_at, project) VALUES (?, ?, ?, ?, ?, ?)",
+                [ (requirement, index_url, os.path.basename(os.path.dirname(x)), os.path.basename(x), now, requirement_project(requirement)) for x in paths ],
+            )
+
+    def fetch_pinned(self, requirement, index_url):
+        """Download an exact pin straight from its index URL, or return None if pip has to handle it."""
+        m = PIN_RE.match(requirement.strip())
+        if m is None:
+            return None
+        name, version = m.groups()
+        x = pick_file(project_files(index_url or DEFAULT_INDEX_URL, name), name, version)
+        if x is None:
+            return None
+
+        dest = self.path(x["sha256"], x["filename"])
+        if os.path.exists(dest):
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO artifacts (sha256, filename, size, last_used) VALUES (?, ?, ?, ?)",
+                    (x["sha256"], x["filename"], os.path.getsize(dest), time.time()),
+                )
+            return [dest]
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            h = hashlib.sha256()
+            with os.fdopen(fd, "wb") as f, http_session().get(x["url"], stream=True, timeout=HTTP_TIMEOUT) as response:
+                response.raise_for_status()
+                for block in response.iter_content(1024 * 1024):
+                    h.update(block)
+                    f.write(block)
+            if h.hexdigest() != x["sha256"]:
+                raise ValueError(f"Hash mismatch for {x['filename']}")
+            return [self.add(tmp_path, x["filename"], x["sha256"])]
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def fetch(self, requirement, index_url):
+        """Return the stored artifact paths for a single requirement (without its dependencies), downloading it if needed."""
+        paths = self.lookup(requirement, index_url)
+        if paths is not None:
+            logger.info(f"Using cached artifacts for {requirement}")
+            return paths
+
+        try:
+            paths = self.fetch_pinned(requirement, index_url)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.warning(f"Direct download of {requirement} failed, falling back to pip: {e}")
+            paths = None
+        if paths is not None:
+            self.remember(requirement, index_url, paths)
+            logger.info(f"Downloaded {requirement} from the index.")
+            self.evict()
+            return paths
+
+        logger.info(f"Downloading {requirement}...")
+        tmpdir = tempfile.mkdtemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            # Run pip in a subprocess: pip.main is not safe to call from threads
+            cmd = [sys.executable, "-m", "pip", "download", "--no-input", "--no-clean", "--no-deps", "-d", tmpdir, requirement]
+            if index_url:
+                cmd += ["-i", index_url]
+            subprocess.run(cmd, check=True, timeout=PIP_TIMEOUT)
+            paths = [ self.add(os.path.join(tmpdir, x)) for x in os.listdir(tmpdir) ]
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        self.remember(requirement, index_url, paths)
+        logger.info(f"Downloaded {requirement}.")
+        self.evict()
+        return paths
+
+    def fetch_into(self, requirement, index_url, dest_dir):
+        """Fetch a requirement and hard link (or copy) its artifacts into dest_dir."""
+        os.makedirs(dest_dir, exist_ok=True)
+        res = []
+        for fpath in self.fetch(requirement, index_url):
+            dest = os.path.join(dest_dir, os.path.basename(fpath))
+            link_or_copy(fpath, dest)
+            res.append(dest)
+        return res
+
+    def fetch_many(self, requirements, index_url, dest_dir, threads=DOWNLOAD_THREADS):
+        """Fetch a batch of requirements concurrently and link them all into dest_dir."""
+        os.makedirs(dest_dir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            res = list(pool.map(lambda x: self.fetch_into(x, index_url, dest_dir), requirements))
+        return [ x for paths in res for x in paths ]
+
+    def evict(self):
+        """Delete least recently used artifacts until the store is under its size cap."""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute(
+                "SELECT sha256, filename, size FROM artifacts WHERE last_used < ? ORDER BY last_used",
+                (time.time() - EVICT_GRACE,),
+            ).fetchall()
+            for sha256, filename, size in rows:
+                if total <= self.max_bytes:
+                    break
+                fpath = self.path(sha256, filename)
+                try:
+                    os.remove(fpath)
+                    os.rmdir(os.path.dirname(fpath))
+                except OSError:
+                    pass
+                conn.execute("DELETE FROM artifacts WHERE sha256 = ? AND filename = ?", (sha256, filename))
+                conn.execute("DELETE FROM requirements WHERE sha256 = ? AND filename = ?", (sha256, filename))
+                total -= size
+                logger.info(f"Evicted {filename} from the artifact store")
@@ -9,62 +9,191 @@ logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %
 logger = logging.getLogger()
 logging.root.setLevel(logging.DEBUG)
 
-import pip
 import os
 import argparse
+import datetime
 import tempfile
 import shutil
-import subprocess
+import traceback
+from multiprocessing import Pool
+from artifacts import ArtifactStore, DEFAULT_ARTIFACT_DIR, DEFAULT_MAX_BYTES
+from bandit_engine import BanditEngine, FileResultCache, DEFAULT_RESULT_CACHE_DIR
+from index import iter_projects
+from sampling import sample_n, DEFAULT_SEED
+from timing import TimingLog, DEFAULT_TIMING_LOG, tree_size
+from partition import parse_shard, in_shard, shard_output_dir, write_manifest, DEFAULT_SHARD_DIR
+from journal import open_output_journal, staging_path, publish, discard, clean_staging, DONE, FAILED
 
 DEFAULT_CACHE_DIR = "./cache/bcache/"
 DEFAULT_OUTPUT_DIR = "./out/bandit/"
 # INDEX_URL = "https://acc-py-repo.cern.ch/repository/vr-py-releases/simple/"
 INDEX_URL = "https://pypi.org/simple/"
+NUM_WORKERS = os.cpu_count() or 1
+
+# Long-lived Bandit engine of this process, created on first use
+engine = None
+# Per-file result cache shared by all workers, set in main()
+result_cache = None
+# Stage timing events, set in main()
+timing = None
+# Journal of the reports in output_dir, set in main() and only used by the main process
+journal = None
+
+def get_engine():
+    global engine
+    if engine is None:
+        engine = BanditEngine(result_cache)
+    return engine
 
 def scan_package(package):
     logger.info(f"Scanning package {package}")
     report_fname = package + '_report.json'
-    if os.path.exists(os.path.join(output_dir, report_fname)):
-        logger.info(f"Report for package {package} already exists, skipping")
-        return
-
     pkg_cache_dir = tempfile.mkdtemp(dir=cache_dir)
-    pip.main(['download', package, '--no-clean', '--no-deps', '-d', pkg_cache_dir, '-i', INDEX_URL])
+    try:
+        with timing.stage(package, "download") as event:
+            artifact_store.fetch_into(package, INDEX_URL, pkg_cache_dir)
+            event["bytes"] = tree_size(pkg_cache_dir)
 
-    for file in os.listdir(pkg_cache_dir):
-        if file.endswith('.whl'):
-            shutil.unpack_archive(os.path.join(pkg_cache_dir, file), pkg_cache_dir, "zip")
+        with timing.stage(package, "unpack"):
+            for file in os.listdir(pkg_cache_dir):
+                if file.endswith('.whl'):
+                    shutil.unpack_archive(os.path.join(pkg_cache_dir, file), pkg_cache_dir, "zip")
 
-    breport_path = os.path.join(pkg_cache_dir, 'bandit_report.json')
-    subprocess.run(['bandit', '-r', pkg_cache_dir, '-f', 'json', '-o', breport_path])
+        breport_path = os.path.join(pkg_cache_dir, 'bandit_report.json')
+        with timing.stage(package, "scan", tree_size(pkg_cache_dir)):
+            get_engine().scan(pkg_cache_dir, breport_path)
 
-    shutil.move(breport_path, os.path.join(output_dir, report_fname))
-
-    shutil.rmtree(pkg_cache_dir)
+        # The cache may be on another file system, copy the report next to
+        # the output directory first so it appears there complete or not at all
+        staged = staging_path(output_dir, report_fname)
+        try:
+            shutil.move(breport_path, staged)
+            publish(staged, os.path.join(output_dir, report_fname))
+        finally:
+            discard(staged)
+    finally:
+        shutil.rmtree(pkg_cache_dir)
 
     logger.info(f"Finished scanning package {package}")
 
+def is_already_done(pkg):
+    return journal.is_done(pkg, "bandit")
+
+def record(package, error=None):
+    if error is None:
+        journal.record(package, "bandit", DONE)
+    else:
+        journal.record(package, "bandit", FAILED, error=error.strip().splitlines()[-1])
+
+def init_worker(cache, output, store, rcache, tlog):
+    global cache_dir, output_dir, artifact_store, result_cache, timing
+    cache_dir = cache
+    output_dir = output
+    artifact_store = store
+    result_cache = rcache
+    timing = tlog
+    # Load the Bandit plugins once per worker, not once per package
+    get_engine()
+
+def batch_worker(package):
+    try:
+        scan_package(package)
+        return package, None
+    except Exception:
+        return package, traceback.format_exc()
+
+def run_batch(packages, workers=NUM_WORKERS):
+    failed = 0
+    todo = [ x for x in packages if not is_already_done(x) ]
+    if len(todo) < len(packages):
+        logger.info(f"Skipping {len(packages) - len(todo)} packages whose reports already exist")
+    packages = todo
+    with Pool(workers, initializer=init_worker, initargs=(cache_dir, output_dir, artifact_store, result_cache, timing)) as pool:
+        for i, (package, error) in enumerate(pool.imap_unordered(batch_worker, packages)):
+            record(package, error)
+            if error is not None:
+                failed += 1
+                logger.error(f"Failed to scan {package}:")
+                logger.error(error)
+            logger.info(f"Progress: {i + 1}/{len(packages)} packages, {failed} failed")
+    return failed
+
+def read_package_list(fpath):
+    with open(fpath) as f:
+        return [ l.strip() for l in f if l.strip() and not l.startswith("#") ]
+
 def main():
-    global cache_dir, output_dir
+    global cache_dir, output_dir, artifact_store, result_cache, timing, journal
 
     # Parse the package name from the command line
     parser = argparse.ArgumentParser()
-    parser.add_argument("package", help="The package to install, or the number of random packages to install from index")
+    parser.add_argument("package", nargs="?", help="The package to scan, or the number of random packages to scan from index")
+    parser.add_argument("--package-list", help="File with one package to scan per line")
+    parser.add_argument("--seed", help="Seed of the random sample, the same seed picks the same packages in every tool", default=DEFAULT_SEED)
+    parser.add_argument("--result-cache-dir", help="The directory of the per-file result cache", default=DEFAULT_RESULT_CACHE_DIR)
+    parser.add_argument("--no-result-cache", help="Scan every file, even if an identical one was scanned before", action="store_true")
+    parser.add_argument("--workers", help="Number of worker processes when scanning several packages", type=int, default=NUM_WORKERS)
     # Parse tmp dir, output dir and index url, if not provided use default values
     parser.add_argument("--cache-dir", help="The directory to store the cache", default=DEFAULT_CACHE_DIR)
-    parser.add_argument("--output-dir", help="The directory to store the output", default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--output-dir", help=f"The directory to store the output (default: {DEFAULT_OUTPUT_DIR}, or the shard's directory with --shard)")
+    parser.add_argument("--shard", help="Only scan the packages of shard i of N, e.g. 2/8", type=parse_shard)
+    parser.add_argument("--shard-dir", help="The directory of the shard-tagged outputs", default=DEFAULT_SHARD_DIR)
+    parser.add_argument("--artifact-dir", help="The shared store of downloaded packages", default=DEFAULT_ARTIFACT_DIR)
+    parser.add_argument("--artifact-max-gb", help="Size cap of the shared artifact store in GiB", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3)
+    parser.add_argument("--timing-log", help="JSON Lines file to append the per-stage timing events to", default=DEFAULT_TIMING_LOG)
 
     args = parser.parse_args()
+    if (args.package is None) == (args.package_list is None):
+        parser.error("give either a package or --package-list")
     package = args.package
     cache_dir = args.cache_dir
-    output_dir = args.output_dir
+    if args.output_dir is not None:
+        output_dir = args.output_dir
+    elif args.shard is not None:
+        output_dir = shard_output_dir("bandit", args.shard, args.shard_dir)
+    else:
+        output_dir = DEFAULT_OUTPUT_DIR
+    artifact_store = ArtifactStore(args.artifact_dir, int(args.artifact_max_gb * 1024 ** 3))
+    if not args.no_result_cache:
+        result_cache = FileResultCache(args.result_cache_dir)
+    timing = TimingLog(args.timing_log, "bandit")
 
     if not os.path.exists(cache_dir):
         os.makedirs(cache_dir)
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    
-    scan_package(package)
+    clean_staging(output_dir)
+    journal = open_output_journal(output_dir, "bandit")
+
+    if args.package_list is not None:
+        packages = read_package_list(args.package_list)
+    elif package.isdigit():
+        logger.info("Fetching package index...")
+        packages = sample_n(iter_projects(INDEX_URL), int(package), args.seed)
+    elif not in_shard(package, args.shard):
+        logger.info(f"Skipping {package} as it is not in shard {args.shard[0]}/{args.shard[1]}")
+        return
+    elif is_already_done(package):
+        logger.info(f"Report for package {package} already exists, skipping")
+        return
+    else:
+        try:
+            scan_package(package)
+        except Exception:
+            record(package, traceback.format_exc())
+            raise
+        record(package)
+        return
+
+    if args.shard is not None:
+        packages = [ x for x in packages if in_shard(x, args.shard) ]
+        write_manifest(output_dir, "bandit", args.shard, started_at=datetime.datetime.now().isoformat(), finished_at=None, packages=len(packages))
+
+    logger.info(f"Scanning {len(packages)} packages with {args.workers} workers...")
+    failed = run_batch(packages, args.workers)
+
+    if args.shard is not None:
+        write_manifest(output_dir, "bandit", args.shard, finished_at=datetime.datetime.now().isoformat(), failed=failed)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,210 @@
+import hashlib
+import importlib
+import json
+import linecache
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULT_CACHE_DIR = "./cache/brcache/"
+
+logger = logging.getLogger()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    sha256 TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (sha256, engine)
+);
+"""
+
+
+def import_bandit():
+    """Import the Bandit library, which our bandit.py shadows when run from this directory."""
+    mod = sys.modules.get("bandit")
+    if mod is not None and os.path.dirname(os.path.abspath(mod.__file__)) == HERE:
+        del sys.modules["bandit"]
+    saved = sys.path[:]
+    sys.path[:] = [ p for p in sys.path if os.path.abspath(p or ".") != HERE ]
+    try:
+        return (
+            importlib.import_module("bandit"),
+            importlib.import_module("bandit.core.config"),
+            importlib.import_module("bandit.core.constants"),
+            importlib.import_module("bandit.core.issue"),
+            importlib.import_module("bandit.core.manager"),
+            importlib.import_module("bandit.core.meta_ast"),
+            importlib.import_module("bandit.core.metrics"),
+            importlib.import_module("bandit.formatters.json"),
+        )
+    finally:
+        sys.path[:] = saved
+
+
+def sha256_file(fpath):
+    h = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FileResultCache:
+    """Bandit results of single files, keyed by content hash and engine settings.
+
+    Vendored modules, setup.py templates and files that did not change
+    between releases are analyzed once and their issues, metrics and errors
+    reused for every other package that ships the same bytes.
+    """
+
+    def __init__(self, root=DEFAULT_RESULT_CACHE_DIR):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.db_path = os.path.join(self.root, "results.db")
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # One short-lived connection per operation, so the cache can be used
+        # from several worker processes at once
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get_many(self, hashes, engine):
+        res = {}
+        hashes = list(hashes)
+        with self._connect() as conn:
+            # Stay below SQLite's limit on the number of parameters
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT sha256, result FROM files WHERE engine = ? AND sha256 IN ({','.join('?' * len(batch))})",
+                    [engine] + batch,
+                )
+                for sha256, result in rows:
+                    res[sha256] = json.loads(result)
+        return res
+
+    def put_many(self, results, engine):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO files (sha256, engine, result, created_at) VALUES (?, ?, ?, ?)",
+                [ (sha256, engine, json.dumps(result), now) for sha256, result in results.items() ],
+            )
+
+
+class BanditEngine:
+    """In-process equivalent of `bandit -r <dir> -f json -o <report>`.
+
+    The configuration, plugins and test set are loaded once and the manager
+    is reset before each scan, so scanning many packages from one process
+    does not pay Bandit's startup cost every time.
+    """
+
+    def __init__(self, cache=None):
+        # The bandit command did not log to our handlers, and its debug
+        # output is several lines per AST node
+        logging.getLogger("bandit").setLevel(logging.WARNING)
+        bandit, config, constants, issue, manager, meta_ast, metrics, formatter = import_bandit()
+        self.version = bandit.__version__
+        self.issue = issue
+        self.meta_ast = meta_ast
+        self.metrics = metrics
+        self.formatter = formatter
+        # Same defaults as the command line: no profile, aggregate by file,
+        # report everything and up to 3 lines of code per issue
+        self.config = config.BanditConfig()
+        self.profile = {
+            "include": set(self.config.get_option("tests") or []),
+            "exclude": set(self.config.get_option("skips") or []),
+        }
+        self.sev_level = constants.RANKING[0]
+        self.conf_level = constants.RANKING[0]
+        self.context_lines = 3
+        self.manager = manager.BanditManager(self.config, "file", quiet=True, profile=self.profile)
+        self.cache = cache
+        # Cached results are only valid for the same Bandit version and tests
+        settings = [self.version, sorted(self.profile["include"]), sorted(self.profile["exclude"])]
+        self.key = hashlib.sha256(json.dumps(settings).encode()).hexdigest()[:16]
+
+    def reset(self):
+        m = self.manager
+        m.files_list = []
+        m.excluded_files = []
+        m.skipped = []
+        m.results = []
+        m.baseline = []
+        m.scores = []
+        m.metrics = self.metrics.Metrics()
+        m.b_ma = self.meta_ast.BanditMetaAst()
+        # Issue code snippets are read through linecache, which would
+        # otherwise keep every scanned file in memory
+        linecache.clearcache()
+
+    def run_cached(self):
+        """Run the tests on the discovered files that are not in the cache and restore the others."""
+        m = self.manager
+        files = m.files_list
+        hashes = {}
+        for fname in files:
+            try:
+                hashes[fname] = sha256_file(fname)
+            except OSError:
+                pass
+        cached = self.cache.get_many(set(hashes.values()), self.key)
+
+        m.files_list = [ x for x in files if hashes.get(x) not in cached ]
+        m.run_tests()
+
+        issues = {}
+        for x in m.results:
+            issues.setdefault(x.fname, []).append(x)
+        skipped = {}
+        for fname, reason in m.get_skipped():
+            skipped.setdefault(fname, []).append(reason)
+
+        new = {}
+        for fname in files:
+            sha256 = hashes.get(fname)
+            if sha256 is None:
+                continue
+            if sha256 in cached:
+                # Reports have the path of the file in this package
+                entry = cached[sha256]
+                for d in entry["issues"]:
+                    m.results.append(self.issue.issue_from_dict(dict(d, filename=fname, code="")))
+                if entry["metrics"] is not None:
+                    m.metrics.data[fname] = dict(entry["metrics"])
+                skipped[fname] = entry["skipped"]
+            elif sha256 not in new:
+                new[sha256] = {
+                    "issues": [ x.as_dict(with_code=False) for x in issues.get(fname, []) ],
+                    "metrics": m.metrics.data.get(fname),
+                    "skipped": skipped.get(fname, []),
+                }
+        self.cache.put_many(new, self.key)
+
+        # Same order and totals as a scan of all files
+        m.skipped = [ (fname, reason) for fname in files for reason in skipped.get(fname, []) ]
+        m.files_list = [ x for x in files if x not in skipped ]
+        m.metrics.data["_totals"] = self.metrics.Metrics().data["_totals"]
+        m.metrics.aggregate()
+        reused = sum(1 for x in files if hashes.get(x) in cached)
+        logger.info(f"Reused cached results for {reused} of {len(files)} files")
+
+    def scan(self, target, report_path):
+        self.reset()
+        self.manager.discover_files([target], recursive=True)
+        if self.cache is None:
+            self.manager.run_tests()
+        else:
+            self.run_cached()
+        with open(report_path, "w") as f:
+            self.formatter.report(self.manager, f, self.sev_level, self.conf_level, lines=self.context_lines)
@@ -0,0 +1,421 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+DEFAULT_BENCH_DIR = "./cache/bench/"
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Distinct files generated per kind of result, packages share them through
+# hard links so a 100k package corpus stays small on disk
+DEFAULT_VARIANTS = 1000
+DEFAULT_PACKETS = 200
+DEFAULT_DNS = 10
+# A run is a regression when it is this much slower, or uses this much more
+# memory, than the baseline
+DEFAULT_TOLERANCE = 0.2
+CORPUS_VERSION = 1
+
+# (tool, engine) pairs that can be benchmarked, see run_case()
+CASES = [
+    ("bandit", "default"),
+    ("guarddog", "default"),
+    ("dynamic", "native"),
+    ("dynamic", "summary"),
+    ("dynamic", "pyshark"),
+]
+DEFAULT_CASES = ["bandit", "guarddog", "dynamic-native", "dynamic-summary"]
+
+DOMAINS = [
+    "pypi.org", "files.pythonhosted.org", "github.com", "objects.githubusercontent.com",
+    "raw.githubusercontent.com", "api.github.com", "www.google.com", "dl.google.com",
+    "registry.npmjs.org", "download.pytorch.org", "archive.ubuntu.com", "ipinfo.io",
+]
+BANDIT_TESTS = [
+    ("B101", "assert_used"), ("B105", "hardcoded_password_string"), ("B110", "try_except_pass"),
+    ("B301", "blacklist"), ("B310", "blacklist"), ("B404", "blacklist"), ("B603", "subprocess_without_shell_equals_true"),
+    ("B602", "subprocess_popen_with_shell_equals_true"), ("B311", "blacklist"), ("B108", "hardcoded_tmp_directory"),
+]
+SEVERITIES = ["LOW", "MEDIUM", "HIGH"]
+GUARDDOG_RULES = [
+    "shady-links", "obfuscation", "exec-base64", "code-execution", "download-executable",
+    "exfiltrate-sensitive-data", "cmd-overwrite", "silent-process-execution", "steganography",
+    "dll-hijacking", "bidirectional-characters", "clipboard-access",
+]
+GUARDDOG_METADATA_RULES = ["empty_information", "release_zero", "single_python_file", "typosquatting", "repository_integrity_mismatch"]
+NOISE_LINES = [
+    "WARNING: The directory '/root/.cache/pip' or its parent directory is not owned by the current user",
+    "Downloading package archive...",
+    "INFO: scanning with semgrep rules",
+    "Collecting metadata from https://pypi.org/pypi/{}/json",
+]
+
+
+def package_names(n):
+    return [ f"bench-pkg-{i:06d}" for i in range(n) ]
+
+
+def bandit_report(rng, pname):
+    """A Bandit JSON report with a heavy-tailed number of issues spread over the files of a package."""
+    module = pname.replace("-", "_")
+    fnames = [ f"./cache/bcache/tmp{pname}/{module}/mod{i}.py" for i in range(rng.randint(1, 40)) ]
+    nissues = 0 if rng.random() < 0.4 else min(2000, int(rng.paretovariate(1.1)))
+
+    def counters(loc):
+        c = {"loc": loc, "nosec": 0, "skipped_tests": 0}
+        for level in ["UNDEFINED"] + SEVERITIES:
+            c[f"SEVERITY.{level}"] = 0
+            c[f"CONFIDENCE.{level}"] = 0
+        return c
+
+    metrics = { x: counters(rng.randint(5, 2000)) for x in fnames }
+    results = []
+    for _ in range(nissues):
+        fname = rng.choice(fnames)
+        test_id, test_name = rng.choice(BANDIT_TESTS)
+        severity, confidence = rng.choice(SEVERITIES), rng.choice(SEVERITIES)
+        line = rng.randint(1, metrics[fname]["loc"])
+        metrics[fname][f"SEVERITY.{severity}"] += 1
+        metrics[fname][f"CONFIDENCE.{confidence}"] += 1
+        results.append({
+            "code": f"{line} import subprocess\n{line + 1} subprocess.call(cmd)\n",
+            "col_offset": 0,
+            "end_col_offset": 30,
+            "filename": fname,
+            "issue_confidence": confidence,
+            "issue_cwe": {"id": 78, "link": "https://cwe.mitre.org/data/definitions/78.html"},
+            "issue_severity": severity,
+            "issue_text": f"Issue reported by {test_name}.",
+            "line_number": line,
+            "line_range": [line, line + 1],
+            "more_info": f"https://bandit.readthedocs.io/en/1.8.3/plugins/{test_id.lower()}_{test_name}.html",
+            "test_id": test_id,
+            "test_name": test_name,
+        })
+    totals = counters(0)
+    for c in metrics.values():
+        for k, v in c.items():
+            totals[k] += v
+    metrics["_totals"] = totals
+    return json.dumps({"errors": [], "generated_at": "2025-01-01T00:00:00Z", "metrics": metrics, "results": results}, indent=2)
+
+
+def guarddog_logs(rng, pname):
+    """GuardDog logs.txt: timestamps around the JSON output, with noise lines and the occasional failed scan."""
+    lines = ["2025-01-01T00:00:00.000000"]
+    lines += [ rng.choice(NOISE_LINES).format(pname) for _ in range(rng.randint(0, 50)) ]
+    r = rng.random()
+    if r < 0.02:
+        lines.append("OSError: [Errno 28] No space left on device")
+    elif r < 0.04:
+        lines.append(f"Error: could not download {pname}")
+    else:
+        results = {}
+        issues = 0
+        for rule in GUARDDOG_RULES:
+            n = 0 if rng.random() < 0.8 else int(rng.paretovariate(1.5))
+            results[rule] = [ {"location": f"{pname}/mod{i}.py:{rng.randint(1, 500)}", "code": "    exec(base64.b64decode(data))", "message": f"Found a match for {rule}"} for i in range(n) ]
+            issues += n
+        for rule in GUARDDOG_METADATA_RULES:
+            if rng.random() < 0.1:
+                results[rule] = f"The package matches {rule}"
+                issues += 1
+            else:
+                results[rule] = None
+        lines.append(json.dumps({"issues": issues, "errors": {}, "results": results, "path": f"/tmp/tmp{pname}/{pname}"}))
+    lines.append("")
+    lines.append("2025-01-01T00:00:42.000000")
+    return "\n".join(lines) + "\n"
+
+
+def ethernet_ipv4(proto, payload, src, dst):
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(payload), 0, 0x4000, 64, proto, 0, src, dst)
+    return b"\x02\x42\xac\x11\x00\x02\x02\x42\xac\x11\x00\x01\x08\x00" + ip + payload
+
+
+def dns_query(rng, name):
+    question = b"".join(bytes([len(x)]) + x.encode() for x in name.split(".")) + b"\x00" + struct.pack("!HH", 1, 1)
+    dns = struct.pack("!HHHHHH", rng.getrandbits(16), 0x0100, 1, 0, 0, 0) + question
+    udp = struct.pack("!HHHH", rng.randint(32768, 60999), 53, 8 + len(dns), 0) + dns
+    return ethernet_ipv4(17, udp, b"\xac\x11\x00\x02", b"\x08\x08\x08\x08")
+
+
+def tcp_segment(rng):
+    payload = bytes(rng.choice([0, 0, 40, 517, 1448, rng.randint(1, 1448)]))
+    tcp = struct.pack("!HHIIBBHHH", rng.randint(32768, 60999), 443, rng.getrandbits(32), rng.getrandbits(32), 5 << 4, 0x18, 65535, 0, 0) + payload
+    return ethernet_ipv4(6, tcp, b"\xac\x11\x00\x02", b"\x97\x65\x00\xdf")
+
+
+def arp_frame():
+    return b"\xff" * 6 + b"\x02\x42\xac\x11\x00\x02\x08\x06" + bytes(28)
+
+
+def capture(rng, npackets, ndns):
+    """A classic pcap of TCP segments, DNS queries and ARP frames, and its summary as pcap.summarize() reports it."""
+    frames = [ tcp_segment(rng) for _ in range(npackets) ]
+    domains = [ rng.choice(DOMAINS) if rng.random() < 0.8 else f"x{rng.getrandbits(32):08x}.{rng.choice(DOMAINS)}" for _ in range(ndns) ]
+    for i, name in enumerate(domains):
+        frames.insert(rng.randint(0, len(frames)) if i else 0, (name, dns_query(rng, name)))
+    # Keep the DNS queries in capture order for the summary
+    domains = [ x[0] for x in frames if isinstance(x, tuple) ]
+    frames = [ x[1] if isinstance(x, tuple) else x for x in frames ]
+    summary = {"packets": len(frames), "size": sum(len(x) for x in frames), "domains": domains}
+    frames += [ arp_frame() for _ in range(rng.randint(0, 3)) ]
+
+    chunks = [struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1)]
+    ts = 1735689600.0
+    for frame in frames:
+        ts += rng.random() * 0.01
+        chunks.append(struct.pack("<IIII", int(ts), int(ts % 1 * 1e6), len(frame), len(frame)))
+        chunks.append(frame)
+    return b"".join(chunks), summary
+
+
+def write_variants(rng, root, args):
+    """Write the distinct files of the corpus into root/variants/, return their sizes."""
+    sizes = {"bandit": [], "guarddog": [], "dynamic": [], "summary": []}
+    vdir = os.path.join(root, "variants")
+    os.makedirs(vdir)
+    for i in range(args.variants):
+        pname = f"variant-{i}"
+        with open(os.path.join(vdir, f"{i}_report.json"), "w") as f:
+            f.write(bandit_report(rng, pname))
+        with open(os.path.join(vdir, f"{i}_logs.txt"), "w") as f:
+            f.write(guarddog_logs(rng, pname))
+        # The dependency phase is usually the busier one
+        package, psummary = capture(rng, rng.randint(args.packets // 2, args.packets * 3 // 2), rng.randint(args.dns // 2, args.dns * 3 // 2))
+        dependencies, dsummary = capture(rng, rng.randint(args.packets, args.packets * 3), rng.randint(args.dns, args.dns * 3))
+        with open(os.path.join(vdir, f"{i}_package.pcap"), "wb") as f:
+            f.write(package)
+        with open(os.path.join(vdir, f"{i}_dependencies.pcap"), "wb") as f:
+            f.write(dependencies)
+        with open(os.path.join(vdir, f"{i}_summary.json"), "w") as f:
+            json.dump({
+                "packets": psummary["packets"],
+                "dep_packets": dsummary["packets"],
+                "packets_size": psummary["size"],
+                "dep_packets_size": dsummary["size"],
+                "packets_domains": psummary["domains"],
+                "dep_packets_domains": dsummary["domains"],
+            }, f)
+        sizes["bandit"].append(os.path.getsize(os.path.join(vdir, f"{i}_report.json")))
+        sizes["guarddog"].append(os.path.getsize(os.path.join(vdir, f"{i}_logs.txt")))
+        sizes["dynamic"].append(len(package) + len(dependencies))
+        sizes["summary"].append(os.path.getsize(os.path.join(vdir, f"{i}_summary.json")))
+    return sizes
+
+
+def link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def generate_corpus(root, npackages, args):
+    """Generate the results of npackages synthetic packages in the layout of ./out/."""
+    params = {"version": CORPUS_VERSION, "variants": args.variants, "packets": args.packets, "dns": args.dns, "seed": args.seed}
+    meta_path = os.path.join(root, "corpus.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        # Smaller runs use the first packages of a larger corpus
+        if meta["params"] == params and meta["packages"] >= npackages:
+            return meta
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+
+    print(f"Generating a corpus of {npackages} packages in {root}...", file=sys.stderr)
+    rng = random.Random(args.seed)
+    sizes = write_variants(rng, root, args)
+    vdir = os.path.join(root, "variants")
+    for d in ["bandit", "guarddog", "dynamic", "dynamic-summary"]:
+        os.makedirs(os.path.join(root, d))
+    for i, pname in enumerate(package_names(npackages)):
+        v = i % args.variants
+        link(os.path.join(vdir, f"{v}_report.json"), os.path.join(root, "bandit", f"{pname}_report.json"))
+        os.makedirs(os.path.join(root, "guarddog", pname))
+        link(os.path.join(vdir, f"{v}_logs.txt"), os.path.join(root, "guarddog", pname, "logs.txt"))
+        os.makedirs(os.path.join(root, "dynamic", pname))
+        link(os.path.join(vdir, f"{v}_package.pcap"), os.path.join(root, "dynamic", pname, "package.pcap"))
+        link(os.path.join(vdir, f"{v}_dependencies.pcap"), os.path.join(root, "dynamic", pname, "dependencies.pcap"))
+        os.makedirs(os.path.join(root, "dynamic-summary", pname))
+        link(os.path.join(vdir, f"{v}_summary.json"), os.path.join(root, "dynamic-summary", pname, "summary.json"))
+
+    meta = {"params": params, "packages": npackages, "sizes": sizes}
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def input_bytes(meta, kind, npackages):
+    sizes = meta["sizes"][kind]
+    full, rest = divmod(npackages, len(sizes))
+    return full * sum(sizes) + sum(sizes[:rest])
+
+
+def run_case(tool, engine, corpus, npackages, workers, outdir, conn):
+    """Process npackages packages of the corpus like process.py does and send back the timing and peak RSS."""
+    # The progress bars and per-package messages of process.py are not wanted here
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+
+    import process
+    process.NUM_WORKERS = workers
+    process.OUTDIR = outdir
+    pnames = package_names(npackages)
+    toplist, top10k = pnames[:1000], pnames[:10000]
+
+    t0 = time.perf_counter()
+    if tool == "bandit":
+        writers = process.open_variants("bandit", pnames, toplist, top10k)
+        process.process_bandit(sample=1, input_dir=os.path.join(corpus, "bandit"), pnames=pnames, sink=process.variant_sink(writers))
+    elif tool == "guarddog":
+        writers = process.open_variants("gd", pnames, toplist, top10k, max_missing=1000)
+        process.process_guarddog(sample=1, input_dir=os.path.join(corpus, "guarddog"), pnames=pnames, sink=process.variant_sink(writers))
+    else:
+        input_dir = os.path.join(corpus, "dynamic-summary" if engine == "summary" else "dynamic")
+        writers = process.open_variants("dynamic", pnames, toplist, top10k)
+        process.process_dynamic(sample=1, input_dir=input_dir, engine="native" if engine == "summary" else engine, pnames=pnames, sink=process.variant_sink(writers))
+    records = sum(w.count for name, _, w in writers if name.endswith("_all"))
+    process.close_variants(writers)
+    seconds = time.perf_counter() - t0
+
+    # ru_maxrss is in KiB on Linux; RUSAGE_CHILDREN is the largest pool worker
+    conn.send({
+        "seconds": seconds,
+        "records": records,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "worker_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    })
+    conn.close()
+
+
+def measure(tool, engine, corpus, npackages, workers):
+    # A fresh interpreter per run, so the peak RSS is that of the run alone
+    ctx = multiprocessing.get_context("spawn")
+    outdir = tempfile.mkdtemp(prefix="bench-results-")
+    recv, send = ctx.Pipe(duplex=False)
+    try:
+        p = ctx.Process(target=run_case, args=(tool, engine, corpus, npackages, workers, outdir, send))
+        p.start()
+        send.close()
+        try:
+            res = recv.recv()
+        except EOFError:
+            res = None
+        p.join()
+        if res is None or p.exitcode != 0:
+            raise RuntimeError(f"Benchmark of {tool}/{engine} on {npackages} packages failed with exit code {p.exitcode}")
+        return res
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+
+def pyshark_available():
+    try:
+        import pyshark
+    except ImportError:
+        return False
+    return shutil.which("tshark") is not None
+
+
+def compare(results, baseline, tolerance):
+    """Return the (case, metric, baseline, current) tuples that regressed by more than tolerance."""
+    previous = { (x["tool"], x["engine"], x["packages"]): x for x in baseline["results"] }
+    regressions = []
+    for x in results:
+        base = previous.get((x["tool"], x["engine"], x["packages"]))
+        if base is None:
+            continue
+        for metric in ["seconds", "peak_rss_mb", "worker_peak_rss_mb"]:
+            if x[metric] > base[metric] * (1 + tolerance):
+                regressions.append((f"{x['tool']}/{x['engine']}/{x['packages']}", metric, base[metric], x[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark process.py on synthetic results")
+    parser.add_argument("--sizes", help="Comma-separated numbers of packages to process", default=",".join(str(x) for x in DEFAULT_SIZES))
+    parser.add_argument("--cases", help="Comma-separated tools to benchmark, dynamic-<engine> for the engines of process_dynamic", default=",".join(DEFAULT_CASES))
+    parser.add_argument("--workers", help="Number of parsing processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", help="Run every case this many times and keep the fastest run", type=int, default=1)
+    parser.add_argument("--bench-dir", help="The directory of the generated corpus", default=DEFAULT_BENCH_DIR)
+    parser.add_argument("--variants", help="Number of distinct files generated per kind of result", type=int, default=DEFAULT_VARIANTS)
+    parser.add_argument("--packets", help="Average number of TCP packets in a package capture", type=int, default=DEFAULT_PACKETS)
+    parser.add_argument("--dns", help="Average number of DNS queries in a package capture", type=int, default=DEFAULT_DNS)
+    parser.add_argument("--seed", help="Seed of the corpus generator", type=int, default=0)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    parser.add_argument("--tolerance", help="Relative slowdown or memory growth over the baseline reported as a regression", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    sizes = [ int(x) for x in args.sizes.split(",") ]
+    cases = []
+    for name in args.cases.split(","):
+        tool, _, engine = name.partition("-")
+        case = (tool, engine or "default")
+        if case not in CASES:
+            parser.error(f"unknown case {name}")
+        if case == ("dynamic", "pyshark") and not pyshark_available():
+            print("Skipping dynamic-pyshark: pyshark or tshark is not installed", file=sys.stderr)
+            continue
+        cases.append(case)
+
+    corpus = os.path.abspath(args.bench_dir)
+    meta = generate_corpus(corpus, max(sizes), args)
+
+    results = []
+    print("\t".join(["tool", "engine", "packages", "seconds", "packages_per_s", "mb_per_s", "peak_rss_mb", "worker_peak_rss_mb"]))
+    for tool, engine in cases:
+        kind = "summary" if engine == "summary" else tool
+        for n in sizes:
+            runs = [ measure(tool, engine, corpus, n, args.workers) for _ in range(args.repeat) ]
+            res = min(runs, key=lambda x: x["seconds"])
+            res = {
+                "tool": tool,
+                "engine": engine,
+                "packages": n,
+                "seconds": res["seconds"],
+                "records": res["records"],
+                "packages_per_s": n / res["seconds"],
+                "mb_per_s": input_bytes(meta, kind, n) / 1024 ** 2 / res["seconds"],
+                "peak_rss_mb": max(x["peak_rss_mb"] for x in runs),
+                "worker_peak_rss_mb": max(x["worker_peak_rss_mb"] for x in runs),
+            }
+            results.append(res)
+            print("\t".join([tool, engine, str(n)] + [ f"{res[k]:.2f}" for k in ["seconds", "packages_per_s", "mb_per_s", "peak_rss_mb", "worker_peak_rss_mb"] ]))
+            sys.stdout.flush()
+
+    report = {
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count(), "workers": args.workers},
+        "corpus": meta["params"],
+        "results": results,
+    }
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["corpus"] != report["corpus"] or baseline["machine"] != report["machine"]:
+            print("Warning: the baseline was taken on another corpus or machine", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for case, metric, before, after in regressions:
+            print(f"Regression in {case}: {metric} {before:.2f} -> {after:.2f}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regression over {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import pcap
+
+DEFAULT_CAPTURE_CACHE_DIR = "./cache/capcache/"
+
+
+def requirements_key(requirements):
+    """Key of an exact set of pinned requirements, independent of their order."""
+    lines = sorted(set(x.strip() for x in requirements if x.strip()))
+    return hashlib.sha256("\n".join(lines).encode()).hexdigest()
+
+
+def merge_summary(summary, dependencies):
+    """Complete a worker summary.json whose dependency phase was not captured."""
+    return {
+        "packets": summary["packets"],
+        "dep_packets": dependencies["packets"],
+        "packets_size": summary["packets_size"],
+        "dep_packets_size": dependencies["size"],
+        "packets_domains": summary["packets_domains"],
+        "dep_packets_domains": dependencies["domains"],
+    }
+
+
+class DependencyCaptureCache:
+    """Dependency-phase captures shared by packages with the same pinned dependencies.
+
+    Every entry lives in <root>/<sha256 of the sorted requirements>/ and holds
+    meta.json (the requirements, the summary of the capture and the snaplen it
+    was taken with) and, when it was kept, dependencies.pcap.
+    """
+
+    def __init__(self, root=DEFAULT_CAPTURE_CACHE_DIR):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def get(self, key, need_pcap=False):
+        """Return the metadata of an entry, or None if the dependencies have to be captured."""
+        entry = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(entry, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Full captures are only reused where a full capture is expected
+        if need_pcap and (meta["snaplen"] is not None or not os.path.exists(os.path.join(entry, "dependencies.pcap"))):
+            return None
+        return meta
+
+    def put(self, key, requirements, outdir, snaplen=None):
+        """Store the dependency phase of a worker run whose output is in outdir."""
+        fpath = os.path.join(outdir, "dependencies.pcap")
+        if os.path.exists(fpath):
+            summary = pcap.summarize(fpath)
+        else:
+            # Summary mode dropped the capture, take its summary instead
+            with open(os.path.join(outdir, "summary.json")) as f:
+                data = json.load(f)
+            summary = {"packets": data["dep_packets"], "size": data["dep_packets_size"], "domains": data["dep_packets_domains"]}
+
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=".tmp-")
+        try:
+            if os.path.exists(fpath):
+                shutil.copy(fpath, os.path.join(tmp, "dependencies.pcap"))
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({
+                    "requirements": sorted(requirements),
+                    "summary": summary,
+                    "snaplen": snaplen,
+                    "created_at": time.time(),
+                }, f)
+            entry = os.path.join(self.root, key)
+            if os.path.exists(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                # Stored by another run in the meantime
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def restore(self, key, meta, outdir):
+        """Fill in the dependency phase of a worker run that skipped its capture.
+
+        The capture only joins the package's own: in summary mode the worker
+        drops both for packages that only query allowlisted domains.
+        """
+        entry = os.path.join(self.root, key)
+        summary_only = os.path.exists(os.path.join(outdir, "summary.json")) and not os.path.exists(os.path.join(outdir, "package.pcap"))
+        if os.path.exists(os.path.join(entry, "dependencies.pcap")) and not summary_only:
+            shutil.copy(os.path.join(entry, "dependencies.pcap"), os.path.join(outdir, "dependencies.pcap"))
+        fpath = os.path.join(outdir, "summary.json")
+        if os.path.exists(fpath):
+            with open(fpath) as f:
+                summary = json.load(f)
+            with open(fpath, "w") as f:
+                json.dump(merge_summary(summary, meta["summary"]), f)
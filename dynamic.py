@@ -10,25 +10,33 @@ logger = logging.getLogger()
 logging.root.setLevel(logging.DEBUG)
 
 from collections import OrderedDict
-import queue
-import time
 import pipgrip
 import pipgrip.cli
 from pipgrip.package_source import PackageSource
 from pipgrip.libs.mixology.version_solver import VersionSolver
 from pipgrip.libs.mixology.package import Package
-import pip
 import os
 import docker
 import argparse
 import tempfile
 import shutil
 import pipgrip.pipper
-import requests
-import random
 import traceback
 import datetime
 import threading
+import hashlib
+import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from artifacts import ArtifactStore, DEFAULT_ARTIFACT_DIR, DEFAULT_MAX_BYTES
+from resolution import ResolutionCache, DEFAULT_RESOLUTION_DIR
+from scheduler import AdaptiveScheduler, MAX_WORKERS
+from index import iter_projects
+from sampling import sample_n, DEFAULT_SEED
+from captures import DependencyCaptureCache, DEFAULT_CAPTURE_CACHE_DIR, requirements_key
+from timing import TimingLog, DEFAULT_TIMING_LOG, tree_size
+from partition import parse_shard, in_shard, shard_output_dir, write_manifest, DEFAULT_SHARD_DIR
+from journal import open_output_journal, staging_path, publish, discard, clean_staging, DONE, FAILED
 
 # Monkey patch pipgrip to add --no-clean option
 orig_get_install_args = pipgrip.pipper._get_install_args
@@ -45,31 +53,194 @@ def _patched_get_wheel_args(*args, **kwargs):
     return r
 pipgrip.pipper._get_wheel_args = _patched_get_wheel_args
 
+# Persistent metadata and lockfile cache, enabled in main()
+resolution_cache = None
+orig_discover_dependencies_and_versions = pipgrip.package_source.discover_dependencies_and_versions
+
+def enable_resolution_cache(cache):
+    global resolution_cache
+    resolution_cache = cache
+    pipgrip.package_source.discover_dependencies_and_versions = cache.wrap_discover(
+        orig_discover_dependencies_and_versions,
+        pipgrip.pipper._get_available_versions,
+        pipgrip.pipper.parse_req,
+    )
+
 DEFAULT_CACHE_DIR = "./cache/dcache/"
 DEFAULT_OUTPUT_DIR = "./out/dynamic/"
 DEFAULT_INDEX_URL = "https://pypi.org/simple/"
 
+# The worker image is tagged with a hash of the files it is built from, so it
+# is only rebuilt when one of them changes
+IMAGE_NAME = "pipgrip"
+IMAGE_FILES = ["Dockerfile", "worker.py", "pcap.py", "timing.py", "worker_requirements.txt"]
+DOCKER_POOL_SIZE = 32
+# Label of the analysis containers, used to count the ones running
+CONTAINER_LABEL = "rep-pkg.dynamic"
+SCHEDULE_STATS = "./log/dynamic_schedule.jsonl"
+# Summary mode (--summary): the worker captures only the first SNAPLEN bytes
+# of each packet, writes summary.json and keeps the captures only for
+# packages that query a domain outside the allowlist
+SNAPLEN = 512
+DEFAULT_ALLOWLIST = ["pypi.org", "pythonhosted.org"]
+CAPTURE_FILES = ["dependencies.pcap", "package.pcap", "summary.json"]
+# Timing events of the stages inside the container, written by worker.py
+WORKER_TIMING_FILE = "timing.jsonl"
+# Written by worker.py, "ok" when the dependencies installed
+DEPENDENCY_OUTCOME_FILE = "dependency_outcome.txt"
+
+# Environment of the worker containers and snaplen of summary mode, set in main()
+worker_environment = {}
+summary_snaplen = None
+# Dependency-phase captures reused across packages, set in main()
+capture_cache = None
+# Pre-started worker containers (--warm), set in main()
+warm_pool = None
+DEFAULT_WARM_DIR = "./cache/warm/"
+# Stage timing events, set in main()
+timing = None
+# Journal of the results in output_dir, set in main()
+journal = None
+
+docker_lock = threading.Lock()
+docker_client = None
+worker_image = None
+
+def get_docker_client():
+    global docker_client
+    with docker_lock:
+        if docker_client is None:
+            docker_client = docker.from_env(max_pool_size=DOCKER_POOL_SIZE)
+        return docker_client
+
+def worker_image_tag():
+    h = hashlib.sha256()
+    for fname in IMAGE_FILES:
+        h.update(fname.encode())
+        h.update(b"\0")
+        with open(fname, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return f"{IMAGE_NAME}:{h.hexdigest()[:16]}"
+
+def get_worker_image():
+    """Return the worker image and the build log lines, building it at most once per run."""
+    global worker_image
+    client = get_docker_client()
+    with docker_lock:
+        if worker_image is not None:
+            return worker_image, [f"Reusing image {worker_image.tags[0]} ({worker_image.id})"]
+
+        tag = worker_image_tag()
+        try:
+            worker_image = client.images.get(tag)
+            logger.info(f"Reusing existing image {tag}")
+            return worker_image, [f"Reusing image {tag} ({worker_image.id})"]
+        except docker.errors.ImageNotFound:
+            pass
+
+        logger.info(f"Building image {tag}...")
+        worker_image, build_logs = client.images.build(path=".", tag=tag, rm=True)
+        build_logs = [ line["stream"].strip() if "stream" in line else str(line) for line in build_logs ]
+        for line in build_logs:
+            logger.info(line)
+        return worker_image, build_logs
+
+class WarmPool:
+    """Worker containers started ahead of time, each waiting for one package.
+
+    Every container gets its own slot directory, whose cache/ and out/
+    subdirectories are mounted when it starts. worker.py waits until a go
+    file shows up in out/, so handing a package over only means moving its
+    files into the slot. Containers are used once: a replacement is started
+    in the background as soon as one is taken.
+    """
+
+    def __init__(self, size, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.ready = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        for _ in range(size):
+            self.executor.submit(self.start)
+
+    def start(self):
+        slot = tempfile.mkdtemp(dir=self.root, prefix="slot-")
+        try:
+            os.makedirs(os.path.join(slot, "cache"))
+            os.makedirs(os.path.join(slot, "out"))
+            volumes = {
+                os.path.join(slot, "cache"): {'bind': '/app/cache', 'mode': 'ro'},
+                os.path.join(slot, "out"): {'bind': '/app/out', 'mode': 'rw'}
+            }
+            image, _ = get_worker_image()
+            environment = dict(worker_environment, WAIT_FOR_GO="1")
+            container = get_docker_client().containers.run(image, volumes=volumes, environment=environment, detach=True, labels=[CONTAINER_LABEL])
+            logger.info(f"Warm container {container.id} started.")
+            self.ready.put((container, slot, None))
+        except Exception as e:
+            logger.error(f"Failed to start a warm container: {e}")
+            self.ready.put((None, slot, e))
+
+    def idle(self):
+        return self.ready.qsize()
+
+    def acquire(self):
+        """Take a warm container and its slot, and start its replacement."""
+        container, slot, error = self.ready.get()
+        self.executor.submit(self.start)
+        if error is not None:
+            shutil.rmtree(slot, ignore_errors=True)
+            raise RuntimeError(f"Warm container failed to start: {error}")
+        return container, slot
+
+    def hand_over(self, slot, pkg_cache_dir, workdir, environment):
+        """Move a prepared package into a slot and let its container go."""
+        for fname in os.listdir(pkg_cache_dir):
+            # A rename, unless the warm directory is on another file system
+            shutil.move(os.path.join(pkg_cache_dir, fname), os.path.join(slot, "cache", fname))
+        for fname in os.listdir(workdir):
+            shutil.copy(os.path.join(workdir, fname), os.path.join(slot, "out", fname))
+        # Written under another name first so the worker never reads half of it
+        with open(os.path.join(slot, "out", "go.tmp"), "w") as f:
+            json.dump(environment, f)
+        os.replace(os.path.join(slot, "out", "go.tmp"), os.path.join(slot, "out", "go"))
+
+    def discard(self, container, slot):
+        """Stop a container and remove its slot, e.g. after a failed hand-over."""
+        if container is not None:
+            try:
+                container.remove(force=True)
+            except docker.errors.APIError:
+                pass
+        shutil.rmtree(slot, ignore_errors=True)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        while True:
+            try:
+                container, slot, _ = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(container, slot)
+
 def fetch_index():
-    response = requests.get(index_url)
-    response.raise_for_status()
-    for l in response.text.split("\n"):
-        if l.startswith('<a href="/simple/'):
-            pkgname = l.split("/")[2]
-            yield pkgname
-
-def random_sample_index(n=None):
-    findex = list(fetch_index())
-    if n is None or n > len(findex):
-        return findex
-    l = random.sample(findex, n)
-    random.shuffle(l)
-    return l
+    return iter_projects(index_url)
+
+def random_sample_index(n=None, seed=DEFAULT_SEED):
+    return sample_n(fetch_index(), n, seed)
+
+def resolve_package(package):
+    # Reuse the lockfile of a recent resolution of the same package
+    if resolution_cache is not None:
+        deptree = resolution_cache.get_lock(package, index_url)
+        if deptree is not None:
+            logger.info(f"Using cached resolution for {package}")
+            return deptree
 
-def install_package(package):
     # Get the dependencies of a package
     source = PackageSource(
-        cache_dir=None,
-        no_cache_dir=True,
+        cache_dir=None if resolution_cache is None else resolution_cache.pip_cache_dir,
+        no_cache_dir=resolution_cache is None,
         index_url=index_url,
         extra_index_url=None,
         pre=None,
@@ -101,16 +272,26 @@ def install_package(package):
     )
     deptree = pipgrip.cli.render_lock(packages_flat)
 
+    # Partial solutions are not cached, so they are retried next time
+    if resolution_cache is not None and exc is None:
+        resolution_cache.put_lock(package, index_url, deptree)
+    return deptree
+
+def install_package(package):
+    with timing.stage(package, "resolve"):
+        deptree = resolve_package(package)
+
     # Create subfolder with package name in cache directory
     pkg_cache_dir = os.path.join(cache_dir, package)
     pkg_cache_dir = os.path.abspath(pkg_cache_dir)
     os.makedirs(pkg_cache_dir, exist_ok=True)
 
-    # Download the dependencies in reverse order
-    for dep in reversed(deptree):
-        logger.info(f"Downloading {dep} into {pkg_cache_dir}...")
-        pip.main(["download", "--no-input", "--no-clean", "--dest", pkg_cache_dir, dep])
-        logger.info(f"Downloaded {dep}.")
+    # Link the pinned lock from the shared artifact store as one batch,
+    # downloading the dependencies that are not there yet concurrently
+    logger.info(f"Fetching {len(deptree)} packages into {pkg_cache_dir}...")
+    with timing.stage(package, "download") as event:
+        artifact_store.fetch_many(list(reversed(deptree)), index_url, pkg_cache_dir)
+        event["bytes"] = tree_size(pkg_cache_dir)
 
     logger.info("All dependencies downloaded.")
 
@@ -129,29 +310,55 @@ def install_package(package):
     with open(os.path.join(tempdir.name, "pkg_only.txt"), "w") as f:
         f.write(package)
 
+    # Packages with the same pinned dependencies reuse one dependency capture
+    environment = dict(worker_environment)
+    capture_key = capture_meta = None
+    if capture_cache is not None:
+        capture_key = requirements_key(deptree_without_root)
+        capture_meta = capture_cache.get(capture_key, need_pcap=summary_snaplen is None)
+        if capture_meta is not None:
+            logger.info(f"Reusing the dependency capture {capture_key[:16]} for {package}")
+            environment["SKIP_DEPENDENCY_CAPTURE"] = "1"
+            # The worker decides whether to keep the captures on these as well
+            environment["DEPENDENCY_DOMAINS"] = ",".join(sorted(set(capture_meta["summary"]["domains"])))
+
     # Store the build start time
     build_started_at = datetime.datetime.now().isoformat()
 
     # Launch a new Docker container and install the package and its dependencies
-    # Use the existing Dockerfile and mount a volume
-    client = docker.from_env()
-    image, build_logs = client.images.build(path=".", tag="pipgrip")
-    build_logs = [ line["stream"].strip() if "stream" in line else str(line) for line in build_logs ]
-    for line in build_logs:
-        logger.info(line)
+    # Use the worker image built from the existing Dockerfile and mount a volume
+    client = get_docker_client()
+    with timing.stage(package, "image"):
+        image, build_logs = get_worker_image()
 
     # Store the build end time
     build_ended_at = datetime.datetime.now().isoformat()
     install_started_at = datetime.datetime.now().isoformat()
 
     # Run the container, but show the logs
-    container = client.containers.run(image, volumes=volumes, detach=True)
-
-    logger.info(f"Container {container.id} started.")
-
-    # Wait for the container to finish
-    exit_code = container.wait()
+    with timing.stage(package, "container_start"):
+        if warm_pool is None:
+            container = client.containers.run(image, volumes=volumes, environment=environment, detach=True, labels=[CONTAINER_LABEL])
+            workdir = tempdir.name
+            logger.info(f"Container {container.id} started.")
+        else:
+            container, slot = warm_pool.acquire()
+            try:
+                # Only what differs between packages, the rest was set at start
+                warm_pool.hand_over(slot, pkg_cache_dir, tempdir.name, { k: v for k, v in environment.items() if k not in worker_environment })
+            except Exception:
+                # The container is waiting for a go file that will never come
+                warm_pool.discard(container, slot)
+                raise
+            workdir = os.path.join(slot, "out")
+            logger.info(f"Warm container {container.id} received {package}.")
+
+    # Wait for the container to finish, worker.py times its own stages
+    with timing.stage(package, "container") as event:
+        exit_code = container.wait()
+        event["outcome"] = "ok" if exit_code.get("StatusCode") == 0 else "error"
     install_ended_at = datetime.datetime.now().isoformat()
+    timing.merge(os.path.join(workdir, WORKER_TIMING_FILE))
 
     # Print the logs
     logs = container.logs()
@@ -160,109 +367,197 @@ def install_package(package):
     logger.info(f"Container {container.id} finished with exit code {exit_code}.")
     container.remove()
 
-    # Copy from the temporary directory to the final output directory
-    outdir = os.path.join(output_dir, package)
-    os.makedirs(outdir, exist_ok=True)
-    shutil.copy(os.path.join(tempdir.name, "dependencies.pcap"), os.path.join(outdir, "dependencies.pcap"))
-    shutil.copy(os.path.join(tempdir.name, "package.pcap"), os.path.join(outdir, "package.pcap"))
-
-    # Clean up the temporary directory
-    tempdir.cleanup()
-
-    # Clean up the cache directory
-    shutil.rmtree(pkg_cache_dir)
-
-    # Write logs and build_logs to a file
-    with open(os.path.join(outdir, "logs.txt"), "w") as f:
-        f.write(build_started_at)
-        f.write("\n")
-        f.write(logs.decode())
-        f.write("\n")
-        f.write(build_ended_at)
-        f.write("\n")
-    with open(os.path.join(outdir, "build_logs.txt"), "w") as f:
-        f.write(install_started_at)
-        f.write("\n")
-        f.write("\n".join(build_logs))
-        f.write("\n")
-        f.write(install_ended_at)
-        f.write("\n")
-    
+    if capture_meta is not None:
+        with timing.stage(package, "capture_restore"):
+            capture_cache.restore(capture_key, capture_meta, workdir)
+    elif capture_key is not None and exit_code.get("StatusCode") == 0:
+        if dependency_outcome(workdir) != "ok":
+            logger.warning(f"Not caching the dependency capture of {package}, its dependencies did not install")
+        else:
+            try:
+                with timing.stage(package, "capture_store"):
+                    capture_cache.put(capture_key, deptree_without_root, workdir, summary_snaplen)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not cache the dependency capture of {package}: {e}")
+
+    # Copy from the temporary directory to a staging directory, which is
+    # moved to the output directory once all files are written
+    outdir = staging_path(output_dir, package)
+    try:
+        os.makedirs(outdir)
+        with timing.stage(package, "capture_copy") as event:
+            event["bytes"] = 0
+            for fname in CAPTURE_FILES:
+                if os.path.exists(os.path.join(workdir, fname)):
+                    shutil.copy(os.path.join(workdir, fname), os.path.join(outdir, fname))
+                    event["bytes"] += os.path.getsize(os.path.join(outdir, fname))
+
+        # Clean up the temporary directory
+        tempdir.cleanup()
+        if warm_pool is not None:
+            shutil.rmtree(slot, ignore_errors=True)
+
+        # Clean up the cache directory
+        shutil.rmtree(pkg_cache_dir)
+
+        # Write logs and build_logs to a file
+        with open(os.path.join(outdir, "logs.txt"), "w") as f:
+            f.write(build_started_at)
+            f.write("\n")
+            f.write(logs.decode())
+            f.write("\n")
+            f.write(build_ended_at)
+            f.write("\n")
+        with open(os.path.join(outdir, "build_logs.txt"), "w") as f:
+            f.write(install_started_at)
+            f.write("\n")
+            f.write("\n".join(build_logs))
+            f.write("\n")
+            f.write(install_ended_at)
+            f.write("\n")
+        publish(outdir, os.path.join(output_dir, package))
+    finally:
+        discard(outdir)
+
     logger.info("Done.")
 
-def is_already_done(pkg):
-    return os.path.exists(os.path.join(output_dir, pkg))
+def dependency_outcome(workdir):
+    # A failed install captured only part of the dependency phase, which must
+    # not be reused for other packages
+    fpath = os.path.join(workdir, DEPENDENCY_OUTCOME_FILE)
+    if not os.path.exists(fpath):
+        return None
+    with open(fpath) as f:
+        return f.read().strip()
 
-def async_worker():
-    global tqueue, output_dir
-    while tqueue.qsize() > 0:
-        try:
-            pkg = tqueue.get()
-            if is_already_done(pkg):
-                logger.info(f"Skipping {pkg} as it is already done.")
-            else:
-                install_package(pkg)
-        except Exception as e:
-            logger.error(f"Failed to install {pkg}:")
-            traceback.print_exc()
-        finally:
-            tqueue.task_done()
+def is_already_done(pkg):
+    return journal.is_done(pkg, "dynamic")
 
-def async_run_all(pkglist):
-    global tqueue
-    tqueue = queue.Queue()
-    for pkg in pkglist:
-        tqueue.put(pkg)
+def record(package, error=None):
+    if error is None:
+        journal.record(package, "dynamic", DONE)
+    else:
+        journal.record(package, "dynamic", FAILED, error=error.strip().splitlines()[-1])
 
-    ts = []
-    for _ in range(10):
-        t = threading.Thread(target=async_worker, daemon=True)
-        t.start()
-        ts.append(t)
-        time.sleep(60)
-    [ e.join() for e in ts ]
-    tqueue.join()
+def run_package(package):
+    try:
+        install_package(package)
+    except Exception:
+        record(package, traceback.format_exc())
+        raise
+    record(package)
+
+def count_containers():
+    client = get_docker_client()
+    running = len(client.containers.list(filters={"label": CONTAINER_LABEL}))
+    # Idle warm containers do not use any resources to speak of
+    return running - (warm_pool.idle() if warm_pool is not None else 0)
+
+def async_task(pkg):
+    if is_already_done(pkg):
+        logger.info(f"Skipping {pkg} as it is already done.")
+        return "skipped"
+    run_package(pkg)
+
+def async_run_all(pkglist, max_workers=MAX_WORKERS):
+    os.makedirs(cache_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    scheduler = AdaptiveScheduler(
+        async_task,
+        max_workers=max_workers,
+        disk_paths=[cache_dir, output_dir, tempfile.gettempdir()],
+        count_containers=count_containers,
+        stats_path=SCHEDULE_STATS,
+    )
+    scheduler.run(pkglist)
 
 def main():
-    global cache_dir, output_dir, index_url
+    global cache_dir, output_dir, index_url, artifact_store, worker_environment, summary_snaplen, capture_cache, warm_pool, timing, journal
 
     # Parse the package name from the command line
     parser = argparse.ArgumentParser()
     parser.add_argument("package", help="The package to install, or the number of random packages to install from index")
+    parser.add_argument("--seed", help="Seed of the random sample, the same seed picks the same packages in every tool", default=DEFAULT_SEED)
     # Parse tmp dir, output dir and index url, if not provided use default values
     parser.add_argument("--cache-dir", help="The directory to store the cache", default=DEFAULT_CACHE_DIR)
-    parser.add_argument("--output-dir", help="The directory to store the output", default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--output-dir", help=f"The directory to store the output (default: {DEFAULT_OUTPUT_DIR}, or the shard's directory with --shard)")
+    parser.add_argument("--shard", help="Only install the packages of shard i of N, e.g. 2/8", type=parse_shard)
+    parser.add_argument("--shard-dir", help="The directory of the shard-tagged outputs", default=DEFAULT_SHARD_DIR)
     parser.add_argument("--index-url", help="The index URL to fetch packages from", default=DEFAULT_INDEX_URL)
+    parser.add_argument("--artifact-dir", help="The shared store of downloaded packages", default=DEFAULT_ARTIFACT_DIR)
+    parser.add_argument("--artifact-max-gb", help="Size cap of the shared artifact store in GiB", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3)
+    parser.add_argument("--resolution-cache-dir", help="The directory of the dependency resolution cache", default=DEFAULT_RESOLUTION_DIR)
+    parser.add_argument("--no-resolution-cache", help="Resolve every package from scratch", action="store_true")
+    parser.add_argument("--summary", help="Summarize the captures in the container and keep them only for packages querying unlisted domains", action="store_true")
+    parser.add_argument("--snaplen", help="Bytes captured per packet in summary mode", type=int, default=SNAPLEN)
+    parser.add_argument("--allowlist", help="Comma-separated domains (and their subdomains) that do not require keeping the captures", default=",".join(DEFAULT_ALLOWLIST))
+    parser.add_argument("--capture-cache-dir", help="The directory of dependency-phase captures shared by packages with the same pinned dependencies", default=DEFAULT_CAPTURE_CACHE_DIR)
+    parser.add_argument("--no-capture-cache", help="Capture the dependency phase of every package", action="store_true")
+    parser.add_argument("--timing-log", help="JSON Lines file to append the per-stage timing events to", default=DEFAULT_TIMING_LOG)
+    parser.add_argument("--warm", help="Number of worker containers to keep started ahead of time", type=int, default=0)
     parser.add_argument("--rasync", help="Run in async mode", action="store_true")
+    parser.add_argument("--max-workers", help="Upper bound of concurrent packages in async mode", type=int, default=MAX_WORKERS)
     parser.add_argument("--show-index", help="Print list of packages in index and exit", action="store_true")
 
     args = parser.parse_args()
     package = args.package
     cache_dir = args.cache_dir
-    output_dir = args.output_dir
+    if args.output_dir is not None:
+        output_dir = args.output_dir
+    elif args.shard is not None:
+        output_dir = shard_output_dir("dynamic", args.shard, args.shard_dir)
+    else:
+        output_dir = DEFAULT_OUTPUT_DIR
     index_url = args.index_url
     show_index = args.show_index
+    artifact_store = ArtifactStore(args.artifact_dir, int(args.artifact_max_gb * 1024 ** 3))
+    if args.summary:
+        worker_environment = {"SUMMARY_MODE": "1", "SNAPLEN": str(args.snaplen), "DOMAIN_ALLOWLIST": args.allowlist}
+        summary_snaplen = args.snaplen
+    if not args.no_capture_cache:
+        capture_cache = DependencyCaptureCache(args.capture_cache_dir)
+    timing = TimingLog(args.timing_log, "dynamic")
+    if not args.no_resolution_cache:
+        enable_resolution_cache(ResolutionCache(args.resolution_cache_dir))
 
     if show_index:
         for pkg in fetch_index():
             print(pkg)
         return
+
+    os.makedirs(output_dir, exist_ok=True)
+    clean_staging(output_dir)
+    journal = open_output_journal(output_dir, "dynamic")
     
     if not package.isdigit():
-        if is_already_done(package):
+        if not in_shard(package, args.shard):
+            logger.info(f"Skipping {package} as it is not in shard {args.shard[0]}/{args.shard[1]}")
+        elif is_already_done(package):
             logger.info(f"Skipping {package} as it is already done.")
         else:
-            install_package(package)
+            run_package(package)
         return
 
     packagenum = int(package)
     logger.info("Fetching package index...")
-    sample = random_sample_index(packagenum)
-    logger.info(f"Installing {packagenum} random packages...")
-    if args.rasync:
-        async_run_all(sample)
-    else:
-        run_all(sample)
+    sample = random_sample_index(packagenum, args.seed)
+    if args.shard is not None:
+        # The nodes split one sample of the whole index between them
+        sample = [ x for x in sample if in_shard(x, args.shard) ]
+        write_manifest(output_dir, "dynamic", args.shard, started_at=datetime.datetime.now().isoformat(), finished_at=None, packages=len(sample))
+    logger.info(f"Installing {len(sample)} random packages...")
+    if args.warm > 0:
+        warm_pool = WarmPool(args.warm, DEFAULT_WARM_DIR)
+    try:
+        if args.rasync:
+            async_run_all(sample, args.max_workers)
+        else:
+            run_all(sample)
+    finally:
+        if warm_pool is not None:
+            warm_pool.close()
+    if args.shard is not None:
+        write_manifest(output_dir, "dynamic", args.shard, finished_at=datetime.datetime.now().isoformat())
 
 def run_all(pkglist):
     for pkg in pkglist:
@@ -270,7 +565,7 @@ def run_all(pkglist):
             if is_already_done(pkg):
                 logger.info(f"Skipping {pkg} as it is already done.")
             else:
-                install_package(pkg)
+                run_package(pkg)
         except Exception as e:
             logger.error(f"Failed to install {pkg}:")
             logger.error(traceback.format_exc())
@@ -13,9 +13,58 @@ import os
 import docker
 import argparse
 import datetime
+import errno
+import queue
+import threading
+import traceback
+from index import iter_projects
+from sampling import sample_n, DEFAULT_SEED
+from timing import TimingLog, DEFAULT_TIMING_LOG
+from partition import parse_shard, in_shard, shard_output_dir, write_manifest, DEFAULT_SHARD_DIR
+from artifacts import ArtifactStore, DEFAULT_ARTIFACT_DIR
+from journal import open_output_journal, staging_path, publish, discard, clean_staging, DONE, FAILED
 
 DEFAULT_CACHE_DIR = "./cache/gcache/"
 DEFAULT_OUTPUT_DIR = "./out/guarddog/"
+GUARDDOG_IMAGE = "ghcr.io/datadog/guarddog"
+NUM_WORKERS = os.cpu_count() or 1
+# Pool containers are replaced after this many scans, so files GuardDog
+# leaves behind do not pile up
+SCANS_PER_CONTAINER = 500
+# Seconds a pool scan may take before its container is killed
+SCAN_TIMEOUT = 15 * 60
+INDEX_URL = "https://pypi.org/simple/"
+# Where the artifact store is mounted (read-only) with --local-artifacts
+ARTIFACT_MOUNT = "/artifacts"
+SDIST_SUFFIXES = (".tar.gz", ".tgz", ".zip")
+# In the output of scans that ran out of disk space, which are not kept
+NO_SPACE_ERROR = "[Errno 28] No space left on device"
+
+# Shared artifact store to scan packages from, set in main()
+artifact_store = None
+# Stage timing events, set in main()
+timing = None
+# Journal of the results in output_dir, set in main()
+journal = None
+
+def scan_target(package):
+    # Scan the archive bandit.py or dynamic.py already downloaded, and let
+    # GuardDog download the package only when there is none
+    if artifact_store is None:
+        return package
+    paths = artifact_store.lookup_project(package, INDEX_URL)
+    if not paths:
+        logger.info(f"No local artifact for {package}, scanning it from the index")
+        return package
+    # Prefer the sdist, which is what GuardDog scans when it downloads the package
+    paths = sorted(paths, key=lambda x: not x.endswith(SDIST_SUFFIXES))
+    rel = os.path.relpath(paths[0], os.path.join(artifact_store.root, "objects"))
+    return f"{ARTIFACT_MOUNT}/{rel}"
+
+def container_volumes():
+    if artifact_store is None:
+        return None
+    return {os.path.join(artifact_store.root, "objects"): {"bind": ARTIFACT_MOUNT, "mode": "ro"}}
 
 def scan_package(package):
     # Launch a new Docker container and install the package and its dependencies
@@ -24,13 +73,16 @@ def scan_package(package):
     install_started_at = datetime.datetime.now().isoformat()
 
     # Run the container, but show the logs
-    cmd = f"pypi scan {package} --output-format=json"
-    container = client.containers.run("ghcr.io/datadog/guarddog", cmd, detach=True)
+    cmd = ["pypi", "scan", scan_target(package), "--output-format=json"]
+    with timing.stage(package, "container_start"):
+        container = client.containers.run(GUARDDOG_IMAGE, cmd, volumes=container_volumes(), detach=True)
 
     logger.info(f"Container {container.id} started.")
 
     # Wait for the container to finish
-    exit_code = container.wait()
+    with timing.stage(package, "scan") as event:
+        exit_code = container.wait()
+        event["outcome"] = "ok" if exit_code.get("StatusCode") == 0 else "error"
     install_ended_at = datetime.datetime.now().isoformat()
 
     # Print the logs
@@ -39,48 +91,245 @@ def scan_package(package):
 
     logger.info(f"Container {container.id} finished with exit code {exit_code}.")
 
-    # Copy from the temporary directory to the final output directory
-    outdir = os.path.join(output_dir, package)
-    os.makedirs(outdir, exist_ok=True)
-
-    # Write logs and build_logs to a file
-    with open(os.path.join(outdir, "logs.txt"), "w") as f:
-        f.write(install_started_at)
-        f.write("\n")
-        f.write(logs.decode())
-        f.write("\n")
-        f.write(install_ended_at)
-        f.write("\n")
-    
     container.remove()
+    write_logs(package, install_started_at, logs, install_ended_at)
     logger.info("Done.")
 
+def write_logs(package, started_at, logs, ended_at):
+    logs = logs.decode()
+    if NO_SPACE_ERROR in logs:
+        raise OSError(errno.ENOSPC, f"GuardDog ran out of disk space scanning {package}")
+
+    # Written aside and moved into place once complete
+    outdir = staging_path(output_dir, package)
+    try:
+        os.makedirs(outdir)
+        # The GuardDog output between the start and end timestamps
+        with open(os.path.join(outdir, "logs.txt"), "w") as f:
+            f.write(started_at)
+            f.write("\n")
+            f.write(logs)
+            f.write("\n")
+            f.write(ended_at)
+            f.write("\n")
+        publish(outdir, os.path.join(output_dir, package))
+    finally:
+        discard(outdir)
+
+class GuardDogPool:
+    """Long-lived GuardDog containers that scan packages with `docker exec`.
+
+    Each of the N containers idles on `sleep infinity` and is fed one package
+    at a time by its own thread, so container start-up is not paid per
+    package. Every scan is still a new GuardDog process, which loads its
+    rules again. A container whose scan takes longer than
+    timeout seconds is killed and its package fails. It is replaced by a
+    fresh one, as is a container that has done SCANS_PER_CONTAINER scans.
+    Besides run(), other thread pools can call scan_package() directly, each
+    calling thread then gets a container of its own until close().
+    """
+
+    def __init__(self, size=NUM_WORKERS, timeout=SCAN_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.client = docker.from_env(max_pool_size=max(10, size))
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.containers = set()
+        self.done = 0
+        self.failed = 0
+        self.total = 0
+
+    def start_container(self, package):
+        with timing.stage(package, "container_start"):
+            container = self.client.containers.run(GUARDDOG_IMAGE, entrypoint=["sleep", "infinity"], volumes=container_volumes(), detach=True, auto_remove=True)
+        logger.info(f"Container {container.id} started.")
+        return container
+
+    def scan(self, container, package):
+        started_at = datetime.datetime.now().isoformat()
+        # A hung GuardDog would block exec_run forever, killing its container ends it
+        timed_out = threading.Event()
+        def expire():
+            timed_out.set()
+            self.stop_container(container)
+        watchdog = threading.Timer(self.timeout, expire)
+        with timing.stage(package, "scan") as event:
+            watchdog.start()
+            try:
+                exit_code, logs = container.exec_run(["guarddog", "pypi", "scan", scan_target(package), "--output-format=json"])
+            except Exception:
+                if not timed_out.is_set():
+                    raise
+            finally:
+                watchdog.cancel()
+            if timed_out.is_set():
+                raise TimeoutError(f"Scan of {package} in container {container.id} timed out after {self.timeout}s")
+            event["bytes"] = len(logs)
+            event["outcome"] = "ok" if exit_code == 0 else "error"
+        ended_at = datetime.datetime.now().isoformat()
+        logger.info(logs.decode())
+        logger.info(f"Scan of {package} in container {container.id} finished with exit code {exit_code}.")
+        write_logs(package, started_at, logs, ended_at)
+
+    def scan_package(self, package):
+        """Scan a package in the container of the calling thread, starting one if needed."""
+        container = getattr(self.local, "container", None)
+        ok = False
+        try:
+            if container is None:
+                container = self.local.container = self.start_container(package)
+                self.local.scans = 0
+                with self.lock:
+                    self.containers.add(container)
+            self.scan(container, package)
+            self.local.scans += 1
+            ok = True
+        finally:
+            if container is not None and (not ok or self.local.scans >= SCANS_PER_CONTAINER):
+                self.release()
+
+    def release(self):
+        """Stop the container of the calling thread."""
+        container = getattr(self.local, "container", None)
+        if container is not None:
+            self.local.container = None
+            with self.lock:
+                self.containers.discard(container)
+            self.stop_container(container)
+
+    def worker(self):
+        while True:
+            try:
+                package = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            error = None
+            try:
+                self.scan_package(package)
+            except Exception:
+                error = traceback.format_exc()
+                logger.error(f"Failed to scan {package}:")
+                logger.error(error)
+            record(package, error)
+            with self.lock:
+                self.done += 1
+                self.failed += error is not None
+                logger.info(f"Progress: {self.done}/{self.total} packages, {self.failed} failed")
+        self.release()
+
+    def stop_container(self, container):
+        try:
+            container.kill()
+        except docker.errors.APIError:
+            pass
+
+    def close(self):
+        """Stop the containers of the threads that called scan_package()."""
+        with self.lock:
+            containers = list(self.containers)
+            self.containers.clear()
+        for container in containers:
+            self.stop_container(container)
+
+    def run(self, packages):
+        for pkg in packages:
+            self.queue.put(pkg)
+        self.total = len(packages)
+        threads = [ threading.Thread(target=self.worker, daemon=True) for _ in range(min(self.size, len(packages))) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+def read_package_list(fpath):
+    with open(fpath) as f:
+        return [ l.strip() for l in f if l.strip() and not l.startswith("#") ]
+
 def is_already_done(pkg):
-    if not os.path.exists(os.path.join(output_dir, pkg)):
-        return False
-    if not os.path.exists(os.path.join(output_dir, pkg, "logs.txt")):
-        return False
-    return True
+    return journal.is_done(pkg, "guarddog")
+
+def record(package, error=None):
+    if error is None:
+        journal.record(package, "guarddog", DONE)
+    else:
+        journal.record(package, "guarddog", FAILED, error=error.strip().splitlines()[-1])
 
 def main():
-    global cache_dir, output_dir
+    global cache_dir, output_dir, artifact_store, timing, journal
 
     # Parse the package name from the command line
     parser = argparse.ArgumentParser()
-    parser.add_argument("package", help="The package to install, or the number of random packages to install from index")
+    parser.add_argument("package", nargs="*", help="The packages to scan, or the number of random packages to scan from index")
+    parser.add_argument("--package-list", help="File with one package to scan per line")
+    parser.add_argument("--seed", help="Seed of the random sample, the same seed picks the same packages in every tool", default=DEFAULT_SEED)
+    parser.add_argument("--workers", help="Number of long-lived GuardDog containers when scanning several packages", type=int, default=NUM_WORKERS)
+    parser.add_argument("--scan-timeout", help="Seconds after which a scan is abandoned and its container replaced", type=int, default=SCAN_TIMEOUT)
     # Parse tmp dir, output dir and index url, if not provided use default values
     parser.add_argument("--cache-dir", help="The directory to store the cache", default=DEFAULT_CACHE_DIR)
-    parser.add_argument("--output-dir", help="The directory to store the output", default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument("--output-dir", help=f"The directory to store the output (default: {DEFAULT_OUTPUT_DIR}, or the shard's directory with --shard)")
+    parser.add_argument("--shard", help="Only scan the packages of shard i of N, e.g. 2/8", type=parse_shard)
+    parser.add_argument("--shard-dir", help="The directory of the shard-tagged outputs", default=DEFAULT_SHARD_DIR)
+    parser.add_argument("--local-artifacts", help="Scan packages from the shared artifact store when they are in it (skips GuardDog's metadata rules)", action="store_true")
+    parser.add_argument("--artifact-dir", help="The shared store of downloaded packages", default=DEFAULT_ARTIFACT_DIR)
+    parser.add_argument("--timing-log", help="JSON Lines file to append the per-stage timing events to", default=DEFAULT_TIMING_LOG)
 
     args = parser.parse_args()
-    pkg = args.package
     cache_dir = args.cache_dir
-    output_dir = args.output_dir
-    
-    if is_already_done(pkg):
-        logger.info(f"Skipping {pkg} as it is already done.")
+    if args.output_dir is not None:
+        output_dir = args.output_dir
+    elif args.shard is not None:
+        output_dir = shard_output_dir("guarddog", args.shard, args.shard_dir)
     else:
-        scan_package(pkg)
+        output_dir = DEFAULT_OUTPUT_DIR
+    timing = TimingLog(args.timing_log, "guarddog")
+    os.makedirs(output_dir, exist_ok=True)
+    clean_staging(output_dir)
+    journal = open_output_journal(output_dir, "guarddog")
+    if args.local_artifacts:
+        artifact_store = ArtifactStore(args.artifact_dir)
+        logger.info("Scanning local artifacts where available: GuardDog does not run its metadata rules on them")
+
+    if args.package_list is not None:
+        packages = args.package + read_package_list(args.package_list)
+    elif len(args.package) == 1 and args.package[0].isdigit():
+        logger.info("Fetching package index...")
+        packages = sample_n(iter_projects(INDEX_URL), int(args.package[0]), args.seed)
+    elif len(args.package) > 0:
+        packages = args.package
+    else:
+        parser.error("give one or more packages or --package-list")
+
+    if args.shard is not None:
+        packages = [ x for x in packages if in_shard(x, args.shard) ]
+        logger.info(f"{len(packages)} packages in shard {args.shard[0]}/{args.shard[1]}")
+        write_manifest(output_dir, "guarddog", args.shard, started_at=datetime.datetime.now().isoformat(), finished_at=None, packages=len(packages))
+
+    todo = []
+    for pkg in packages:
+        if is_already_done(pkg):
+            logger.info(f"Skipping {pkg} as it is already done.")
+        else:
+            todo.append(pkg)
+
+    if len(packages) == 1:
+        for pkg in todo:
+            try:
+                scan_package(pkg)
+            except Exception:
+                record(pkg, traceback.format_exc())
+                raise
+            record(pkg)
+        failed = 0
+    else:
+        logger.info(f"Scanning {len(todo)} packages with {args.workers} containers...")
+        pool = GuardDogPool(args.workers, args.scan_timeout)
+        pool.run(todo)
+        failed = pool.failed
+
+    if args.shard is not None:
+        write_manifest(output_dir, "guarddog", args.shard, finished_at=datetime.datetime.now().isoformat(), failed=failed)
 
 if __name__ == "__main__":
     main()
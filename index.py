@@ -0,0 +1,152 @@
+import codecs
+import hashlib
+import html
+import json
+import os
+import re
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+import requests
+
+DEFAULT_INDEX_URL = "https://pypi.org/simple/"
+DEFAULT_INDEX_CACHE_DIR = "./cache/icache/"
+# The local copy is used without asking the index for this long, after
+# which it is revalidated with ETag / If-Modified-Since
+MAX_AGE = 3600
+HTTP_TIMEOUT = 60
+CHUNK_SIZE = 256 * 1024
+# PEP 691: prefer the JSON form of the simple API, fall back to HTML
+ACCEPT = "application/vnd.pypi.simple.v1+json, application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.1"
+
+JSON_NAME_RE = re.compile(r'"name"\s*:\s*("(?:[^"\\]|\\.)*")')
+HTML_ANCHOR_RE = re.compile(r"<a\b[^>]*>([^<]*)</a\s*>", re.IGNORECASE)
+# Unmatched text kept between chunks is capped, a project entry is far shorter
+MAX_PENDING = 64 * 1024
+
+
+def normalize(name):
+    # PEP 503 name normalization
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_names(chunks, is_json):
+    """Yield the normalized project names of a simple index page given as text chunks."""
+    regex = JSON_NAME_RE if is_json else HTML_ANCHOR_RE
+    decode = json.loads if is_json else html.unescape
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        end = 0
+        for m in regex.finditer(pending):
+            name = decode(m.group(1)).strip()
+            if name:
+                yield normalize(name)
+            end = m.end()
+        pending = pending[end:]
+        if len(pending) > MAX_PENDING:
+            pending = pending[-MAX_PENDING:]
+
+
+def decode_chunks(chunks, encoding="utf-8"):
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def local_path(index_url):
+    """Return the file or directory of a local mirror, or None for a remote index."""
+    if index_url.startswith("file://"):
+        return urllib.request.url2pathname(urllib.parse.urlparse(index_url).path)
+    if "://" not in index_url and os.path.exists(index_url):
+        return index_url
+    return None
+
+
+def read_local(path):
+    if os.path.isdir(path):
+        for fname in ["index.json", "index.html"]:
+            if os.path.exists(os.path.join(path, fname)):
+                path = os.path.join(path, fname)
+                break
+        else:
+            raise FileNotFoundError(f"No index.json or index.html in {path}")
+    with open(path, "rb") as f:
+        chunks = iter(lambda: f.read(CHUNK_SIZE), b"")
+        yield from parse_names(decode_chunks(chunks), path.endswith(".json"))
+
+
+def read_names(fpath):
+    with open(fpath) as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+def iter_projects(index_url=DEFAULT_INDEX_URL, cache_dir=DEFAULT_INDEX_CACHE_DIR, max_age=MAX_AGE):
+    """Yield the normalized names of all projects of a package index.
+
+    The index is streamed and parsed as it arrives, and a copy of the names
+    is kept in cache_dir: for max_age seconds it is used as is, later it is
+    revalidated with a conditional request. index_url can also be a local
+    mirror, either a file:// URL or a path to a simple index page or to a
+    directory holding index.json or index.html.
+    """
+    path = local_path(index_url)
+    if path is not None:
+        yield from read_local(path)
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = hashlib.sha256(index_url.encode()).hexdigest()[:16]
+    names_path = os.path.join(cache_dir, f"{key}.txt")
+    meta_path = os.path.join(cache_dir, f"{key}.json")
+    meta = {}
+    if os.path.exists(names_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if time.time() - meta["fetched_at"] < max_age:
+            yield from read_names(names_path)
+            return
+
+    headers = {"Accept": ACCEPT}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    with requests.get(index_url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as response:
+        if response.status_code == 304:
+            not_modified = True
+        else:
+            not_modified = False
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "")
+            is_json = "json" in content_type
+            encoding = response.encoding if "charset" in content_type else "utf-8"
+            chunks = decode_chunks(response.iter_content(CHUNK_SIZE), encoding)
+            # Written next to the copy and only moved over it once the whole
+            # index went through, so a consumer that stops early leaves it intact
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    for name in parse_names(chunks, is_json):
+                        f.write(name + "\n")
+                        yield name
+                os.replace(tmp_path, names_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            meta = {
+                "url": index_url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+
+    meta["fetched_at"] = time.time()
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    if not_modified:
+        yield from read_names(names_path)
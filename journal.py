@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+DEFAULT_JOURNAL = "./out/journal.jsonl"
+# Next to an output directory, like the shard manifest: its journal, and the
+# directory results are written to before they are moved into place
+JOURNAL_SUFFIX = ".journal.jsonl"
+STAGING_SUFFIX = ".staging"
+
+# Statuses of a stage of a package, the last one recorded wins
+STARTED = "started"
+DONE = "done"
+FAILED = "failed"
+
+
+class Journal:
+    """Durable, append-only record of the stages run for every package.
+
+    Each status change is one JSON line {"package", "stage", "status", "time",
+    ...} that is flushed and fsynced before record() returns, so after a crash
+    the journal still says which stages finished. The latest entry of every
+    (stage, package) is kept in memory, so lookups never touch the disk.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL, sync=True):
+        self.path = path
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.index = {}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.load()
+        self.f = open(path, "a")
+        # A run killed halfway through a line left it without its newline
+        if self.f.tell() > 0 and not self.ends_with_newline():
+            self.f.write("\n")
+            self.f.flush()
+
+    def ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.index[(entry["stage"], entry["package"])] = entry
+
+    def record(self, package, stage, status, **fields):
+        entry = {"package": package, "stage": stage, "status": status, "time": time.time(), **fields}
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+            if self.sync:
+                os.fsync(self.f.fileno())
+            self.index[(stage, package)] = entry
+
+    def get(self, package, stage):
+        """Return the latest entry of a stage of a package, or None."""
+        return self.index.get((stage, package))
+
+    def status(self, package, stage):
+        entry = self.index.get((stage, package))
+        return None if entry is None else entry["status"]
+
+    def is_done(self, package, stage):
+        return self.status(package, stage) == DONE
+
+    def entries(self, stage=None):
+        return [ x for x in self.index.values() if stage is None or x["stage"] == stage ]
+
+    def flush(self):
+        with self.lock:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def compact(self):
+        """Rewrite the journal with only the latest entry of every stage of every package.
+
+        Entries appended by other processes in the meantime would be lost, so
+        only compact a journal no other process is writing to.
+        """
+        with self.lock:
+            self.f.close()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for entry in self.index.values():
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.f = open(self.path, "a")
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def output_journal(output_dir):
+    """Path of the journal of the results in an output directory, e.g. ./out/bandit.journal.jsonl."""
+    return os.path.normpath(output_dir) + JOURNAL_SUFFIX
+
+
+def bandit_output_complete(fpath):
+    # The JSON report was written in one go, a cut one does not end its object
+    with open(fpath, "rb") as f:
+        f.seek(max(0, os.path.getsize(fpath) - 16))
+        return f.read().rstrip().endswith(b"}")
+
+
+def guarddog_output_complete(fpath):
+    fpath = os.path.join(fpath, "logs.txt")
+    if not os.path.isfile(fpath):
+        return False
+    with open(fpath, errors="replace") as f:
+        data = f.read()
+    # The end timestamp is written last, and a scan that ran out of disk is redone
+    return data.endswith("\n") and "[Errno 28] No space left on device" not in data
+
+
+def dynamic_output_complete(fpath):
+    # build_logs.txt is written last
+    fpath = os.path.join(fpath, "build_logs.txt")
+    return os.path.isfile(fpath) and os.path.getsize(fpath) > 0
+
+
+# How to tell the complete results each tool wrote before it had a journal
+LEGACY_OUTPUTS = {
+    "bandit": ("_report.json", bandit_output_complete),
+    "guarddog": ("", guarddog_output_complete),
+    "dynamic": ("", dynamic_output_complete),
+}
+
+
+def open_output_journal(output_dir, tool):
+    """Open the journal of the results of a tool in output_dir.
+
+    A new journal first records the complete results already in output_dir,
+    so results written before there was a journal are not redone. That is the
+    only time the output directory is listed, later runs only read the journal.
+    """
+    path = output_journal(output_dir)
+    if os.path.exists(path) or not os.path.isdir(output_dir):
+        return Journal(path)
+    journal = Journal(path, sync=False)
+    suffix, complete = LEGACY_OUTPUTS[tool]
+    for entry in os.scandir(output_dir):
+        if not entry.name.endswith(suffix):
+            continue
+        package = entry.name[:len(entry.name) - len(suffix)]
+        if complete(entry.path):
+            journal.record(package, tool, DONE, imported=True)
+    journal.flush()
+    journal.sync = True
+    return journal
+
+
+def staging_path(output_dir, name):
+    """Return a new path to write the result name of output_dir to, before publish().
+
+    The staging directory is next to output_dir, so on the same file system,
+    and the result is moved into place with a single rename. Readers of
+    output_dir never see a half-written result.
+    """
+    root = os.path.normpath(output_dir) + STAGING_SUFFIX
+    os.makedirs(root, exist_ok=True)
+    return os.path.join(root, f"{name}.{os.getpid()}.{uuid.uuid4().hex[:8]}")
+
+
+def publish(staged, dst):
+    """Move a staged file or directory to dst, replacing what an older run left there."""
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    os.replace(staged, dst)
+
+
+def discard(staged):
+    """Remove a staged result that was not published, if any."""
+    if os.path.isdir(staged):
+        shutil.rmtree(staged, ignore_errors=True)
+    elif os.path.lexists(staged):
+        os.remove(staged)
+
+
+def clean_staging(output_dir):
+    """Remove the staged results of runs that are no longer running."""
+    root = os.path.normpath(output_dir) + STAGING_SUFFIX
+    if not os.path.isdir(root):
+        return
+    for entry in os.listdir(root):
+        try:
+            pid = int(entry.rsplit(".", 2)[1])
+            os.kill(pid, 0)
+            continue
+        except (IndexError, ValueError, ProcessLookupError):
+            pass
+        except PermissionError:
+            # Running as another user
+            continue
+        discard(os.path.join(root, entry))
@@ -0,0 +1,83 @@
+import json
+import os
+import sqlite3
+
+DEFAULT_MANIFEST = "./cache/pcache/manifest.db"
+# Number of new summaries written before committing
+COMMIT_EVERY = 1000
+
+MISSING = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    tool TEXT NOT NULL,
+    package TEXT NOT NULL,
+    path TEXT NOT NULL,
+    stamp TEXT NOT NULL,
+    record TEXT,
+    PRIMARY KEY (tool, package)
+)
+"""
+
+
+class Manifest:
+    """Persistent per-file cache of parsed result summaries.
+
+    Entries are keyed by tool and package and are only reused while the size
+    and mtime of every file they were parsed from are unchanged. Only a short
+    summary is kept per file, the records themselves are in the result shards.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def stamp(*paths):
+        res = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                res.append([st.st_size, st.st_mtime_ns])
+            except OSError:
+                res.append(None)
+        return json.dumps(res)
+
+    def get(self, tool, package, stamp):
+        """Return the cached summary (None for files that were skipped), or MISSING."""
+        row = self.conn.execute("SELECT stamp, record FROM files WHERE tool = ? AND package = ?", (tool, package)).fetchone()
+        if row is None or row[0] != stamp:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return None if row[1] is None else json.loads(row[1])
+
+    def put(self, tool, package, path, stamp, record):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (tool, package, path, stamp, record) VALUES (?, ?, ?, ?, ?)",
+            (tool, package, path, stamp, None if record is None else json.dumps(record)),
+        )
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,135 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import shutil
+import sys
+
+from journal import open_output_journal, DONE
+from partition import DEFAULT_SHARD_DIR, MANIFEST_SUFFIX, in_shard
+
+DEFAULT_OUT_DIR = "./out/"
+TOOLS = ["bandit", "guarddog", "dynamic"]
+# Bandit writes one <package>_report.json file per package, the other tools one directory
+SUFFIXES = {"bandit": "_report.json"}
+
+
+def find_shards(shard_dir):
+    """Return {tool: [(output directory, manifest)]} for the shard outputs under shard_dir."""
+    shards = {}
+    for fpath in sorted(glob.glob(os.path.join(glob.escape(shard_dir), "*", "*" + MANIFEST_SUFFIX))):
+        with open(fpath) as f:
+            manifest = json.load(f)
+        shards.setdefault(manifest["tool"], []).append((fpath[:-len(MANIFEST_SUFFIX)], manifest))
+    return shards
+
+
+def check_shards(tool, shards):
+    """Return what keeps the shards of a tool from covering the whole partition exactly once."""
+    problems = []
+    counts = set(m["count"] for _, m in shards)
+    if len(counts) > 1:
+        problems.append(f"{tool}: shards of different partitions ({', '.join(str(x) for x in sorted(counts))} shards)")
+        return problems
+    count = counts.pop()
+    indices = [ m["shard"] for _, m in shards ]
+    for i in sorted(set(x for x in indices if indices.count(x) > 1)):
+        problems.append(f"{tool}: shard {i}/{count} appears {indices.count(i)} times")
+    missing = sorted(set(range(count)).difference(indices))
+    if missing:
+        problems.append(f"{tool}: missing shards {', '.join(str(x) for x in missing)} of {count}")
+    for _, m in shards:
+        if m.get("finished_at") is None:
+            problems.append(f"{tool}: shard {m['shard']}/{count} on {m.get('host')} has not finished")
+    return problems
+
+
+def place(src, dst, mode):
+    if mode == "move":
+        shutil.move(src, dst)
+        return
+
+    def copy(s, d):
+        if mode == "link":
+            try:
+                os.link(s, d)
+                return
+            except OSError:
+                # Another file system, or links not supported
+                pass
+        shutil.copy2(s, d)
+
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, copy_function=copy)
+    else:
+        copy(src, dst)
+
+
+def merge_tool(tool, shards, output_dir, mode):
+    """Merge the shard outputs of a tool into output_dir, return counts of what was done."""
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = SUFFIXES.get(tool, "")
+    stats = {"merged": 0, "existing": 0, "stray": 0}
+    # So later runs of the tool on the merged layout skip the merged packages
+    journal = open_output_journal(output_dir, tool)
+    journal.sync = False
+    for shard_output, manifest in shards:
+        shard = (manifest["shard"], manifest["count"])
+        if not os.path.isdir(shard_output):
+            continue
+        for entry in sorted(os.listdir(shard_output)):
+            pname = entry[:-len(suffix)] if suffix and entry.endswith(suffix) else entry
+            if not in_shard(pname, shard):
+                # Still merged, but the node was given packages of another shard
+                print(f"{tool}: {pname} does not belong to shard {shard[0]}/{shard[1]}", file=sys.stderr)
+                stats["stray"] += 1
+            dst = os.path.join(output_dir, entry)
+            if os.path.lexists(dst):
+                stats["existing"] += 1
+                continue
+            place(os.path.join(shard_output, entry), dst, mode)
+            journal.record(pname, tool, DONE, shard=shard[0])
+            stats["merged"] += 1
+    journal.flush()
+    journal.close()
+
+    # The shard manifests, combined, say where the merged results came from
+    with open(os.path.normpath(output_dir) + ".shards.json", "w") as f:
+        json.dump({
+            "tool": tool,
+            "merged_at": datetime.datetime.now().isoformat(),
+            "shards": [ m for _, m in shards ],
+            **stats,
+        }, f, indent=2)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the shard-tagged outputs of bandit.py, guarddog.py and dynamic.py into the layout process.py reads")
+    parser.add_argument("--shard-dir", help="The directory of the shard-tagged outputs", default=DEFAULT_SHARD_DIR)
+    parser.add_argument("--out-dir", help="Where to merge to, one subdirectory per tool", default=DEFAULT_OUT_DIR)
+    parser.add_argument("--tools", help="Comma-separated tools to merge", default=",".join(TOOLS))
+    parser.add_argument("--mode", help="How results get into the merged layout", choices=["link", "copy", "move"], default="link")
+    parser.add_argument("--allow-partial", help="Merge even if shards are missing or have not finished", action="store_true")
+    args = parser.parse_args()
+
+    shards = find_shards(args.shard_dir)
+    tools = [ x for x in args.tools.split(",") if x in shards ]
+    if not tools:
+        parser.error(f"no shard outputs in {args.shard_dir}")
+
+    problems = [ p for tool in tools for p in check_shards(tool, shards[tool]) ]
+    for p in problems:
+        print(p, file=sys.stderr)
+    if problems and not args.allow_partial:
+        print("Not merging, pass --allow-partial to merge anyway", file=sys.stderr)
+        sys.exit(1)
+
+    for tool in tools:
+        stats = merge_tool(tool, shards[tool], os.path.join(args.out_dir, tool), args.mode)
+        print(f"{tool}: merged {stats['merged']} packages from {len(shards[tool])} shards, {stats['existing']} already there, {stats['stray']} in the wrong shard")
+
+
+if __name__ == "__main__":
+    main()
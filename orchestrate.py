@@ -0,0 +1,272 @@
+import logging
+import os
+
+# Log to both stdout and a file, before the analysis modules set up logging
+# to their own files
+LOGFILE = "./log/orchestrate.log"
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s", handlers=[
+    logging.FileHandler(LOGFILE),
+    logging.StreamHandler()
+])
+logger = logging.getLogger()
+logging.root.setLevel(logging.DEBUG)
+
+import argparse
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import bandit
+import dynamic
+import guarddog
+from artifacts import ArtifactStore, DEFAULT_ARTIFACT_DIR, DEFAULT_MAX_BYTES
+from bandit_engine import FileResultCache
+from captures import DependencyCaptureCache
+from index import iter_projects
+from journal import Journal, DEFAULT_JOURNAL, STARTED, DONE, FAILED, open_output_journal, clean_staging
+from resolution import ResolutionCache
+from sampling import sample_n, DEFAULT_SEED
+from timing import TimingLog, DEFAULT_TIMING_LOG
+
+INDEX_URL = "https://pypi.org/simple/"
+STAGES = ["bandit", "guarddog", "dynamic"]
+# Concurrent packages per stage type: downloads wait on the network, Bandit
+# on the CPU, GuardDog and dynamic analysis on their containers
+DEFAULT_LIMITS = {
+    "fetch": 8,
+    "bandit": os.cpu_count() or 1,
+    "guarddog": max(1, (os.cpu_count() or 1) // 2),
+    "dynamic": 4,
+}
+
+
+# The analysis modules, whose journals also record the results of their own CLI runs
+MODULES = {"bandit": bandit, "guarddog": guarddog, "dynamic": dynamic}
+
+
+def bandit_task(package):
+    # Sent to the worker processes by reference to this module: once the
+    # Bandit engine is loaded there, "bandit" is the library, not bandit.py
+    return bandit.batch_worker(package)
+
+
+class Orchestrator:
+    """Runs a DAG per package: fetch it once, then run the analyses on it concurrently.
+
+    Every stage type has an executor of its own, whose size is its
+    concurrency limit. At most max_in_flight packages are between their
+    fetch and their last analysis, so fetching does not run away from the
+    analyses. Every stage start and outcome goes to the journal, and a stage
+    it or the journal of the analysis has as done is never run again. The
+    analyses only move complete results into their output directories, so
+    an interrupted stage simply runs again.
+    """
+
+    def __init__(self, stages, limits, journal, store, max_in_flight):
+        self.stages = stages
+        self.journal = journal
+        self.store = store
+        self.executors = {"fetch": ThreadPoolExecutor(max_workers=limits["fetch"])}
+        if "bandit" in stages:
+            # Bandit is CPU bound, so its scans run in processes with one engine each
+            self.executors["bandit"] = ProcessPoolExecutor(max_workers=limits["bandit"], initializer=bandit.init_worker,
+                initargs=(bandit.cache_dir, bandit.output_dir, store, bandit.result_cache, bandit.timing))
+            # Fork the workers now, before any other thread holds a lock
+            self.executors["bandit"].submit(os.getpid).result()
+        self.guarddog_pool = None
+        if "guarddog" in stages:
+            self.guarddog_pool = guarddog.GuardDogPool(limits["guarddog"])
+            self.executors["guarddog"] = ThreadPoolExecutor(max_workers=limits["guarddog"])
+        if "dynamic" in stages:
+            self.executors["dynamic"] = ThreadPoolExecutor(max_workers=limits["dynamic"])
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Condition()
+        self.remaining = {}
+        self.failed_packages = set()
+        self.done = 0
+        self.failed = 0
+        self.total = 0
+
+    def stage_task(self, stage):
+        if stage == "fetch":
+            return lambda package: self.store.fetch(package, INDEX_URL)
+        if stage == "bandit":
+            return bandit_task
+        if stage == "guarddog":
+            return self.guarddog_pool.scan_package
+        return dynamic.install_package
+
+    def run(self, packages):
+        self.total = len(packages)
+        for package in packages:
+            self.slots.acquire()
+            with self.lock:
+                self.remaining[package] = None
+            try:
+                self.submit(package)
+            except Exception:
+                logger.error(f"Failed to schedule {package}:")
+                logger.error(traceback.format_exc())
+                self.finish(package, ok=False)
+        with self.lock:
+            self.lock.wait_for(lambda: not self.remaining)
+
+    def submit(self, package):
+        todo = []
+        for stage in self.stages:
+            if self.journal.is_done(package, stage):
+                continue
+            if MODULES[stage].is_already_done(package):
+                self.journal.record(package, stage, DONE, existing=True)
+                continue
+            todo.append(stage)
+
+        with self.lock:
+            self.remaining[package] = len(todo)
+        if not todo:
+            logger.info(f"Skipping {package} as all its stages are done.")
+            self.finish(package)
+        elif self.journal.is_done(package, "fetch"):
+            self.start_analyses(package, todo)
+        else:
+            self.run_stage(package, "fetch", lambda ok: self.start_analyses(package, todo) if ok else self.finish(package, ok=False))
+
+    def start_analyses(self, package, todo):
+        for stage in todo:
+            self.run_stage(package, stage, lambda ok: self.analysis_done(package, ok))
+
+    def run_stage(self, package, stage, then):
+        self.journal.record(package, stage, STARTED)
+        future = self.executors[stage].submit(self.stage_task(stage), package)
+        future.add_done_callback(lambda f: self.stage_done(package, stage, f, then))
+
+    def stage_done(self, package, stage, future, then):
+        error = future.exception()
+        if error is None and stage == "bandit":
+            # bandit.batch_worker returns the traceback instead of raising
+            error = future.result()[1]
+        if error is None:
+            if stage in MODULES:
+                MODULES[stage].record(package)
+            self.journal.record(package, stage, DONE)
+        else:
+            message = error if isinstance(error, str) else "".join(traceback.format_exception(error))
+            logger.error(f"Stage {stage} of {package} failed:")
+            logger.error(message)
+            if stage in MODULES:
+                MODULES[stage].record(package, message)
+            self.journal.record(package, stage, FAILED, error=message.strip().splitlines()[-1])
+        try:
+            then(error is None)
+        except Exception:
+            logger.error(traceback.format_exc())
+            self.finish(package, ok=False)
+
+    def analysis_done(self, package, ok):
+        with self.lock:
+            if package not in self.remaining:
+                return
+            self.remaining[package] -= 1
+            if not ok:
+                self.failed_packages.add(package)
+            last = self.remaining[package] == 0
+        if last:
+            self.finish(package)
+
+    def finish(self, package, ok=True):
+        with self.lock:
+            if package not in self.remaining:
+                return
+            del self.remaining[package]
+            self.done += 1
+            if not ok:
+                self.failed_packages.add(package)
+            self.failed += package in self.failed_packages
+            self.failed_packages.discard(package)
+            logger.info(f"Progress: {self.done}/{self.total} packages, {self.failed} with failed stages")
+            self.lock.notify_all()
+        self.slots.release()
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+        if self.guarddog_pool is not None:
+            self.guarddog_pool.close()
+
+
+def configure(args, store):
+    """Point the analysis modules at their default directories, journals and the shared caches."""
+    bandit.cache_dir = bandit.DEFAULT_CACHE_DIR
+    bandit.output_dir = bandit.DEFAULT_OUTPUT_DIR
+    bandit.artifact_store = store
+    bandit.result_cache = FileResultCache()
+    bandit.timing = TimingLog(args.timing_log, "bandit")
+    os.makedirs(bandit.cache_dir, exist_ok=True)
+
+    guarddog.cache_dir = guarddog.DEFAULT_CACHE_DIR
+    guarddog.output_dir = guarddog.DEFAULT_OUTPUT_DIR
+    # GuardDog scans the downloaded artifact instead of downloading it again
+    guarddog.artifact_store = store
+    guarddog.timing = TimingLog(args.timing_log, "guarddog")
+
+    dynamic.cache_dir = dynamic.DEFAULT_CACHE_DIR
+    dynamic.output_dir = dynamic.DEFAULT_OUTPUT_DIR
+    dynamic.index_url = INDEX_URL
+    dynamic.artifact_store = store
+    dynamic.capture_cache = DependencyCaptureCache()
+    dynamic.timing = TimingLog(args.timing_log, "dynamic")
+    dynamic.enable_resolution_cache(ResolutionCache())
+
+    for stage, module in MODULES.items():
+        os.makedirs(module.output_dir, exist_ok=True)
+        clean_staging(module.output_dir)
+        module.journal = open_output_journal(module.output_dir, stage)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Bandit, GuardDog and dynamic analysis on packages from a single download")
+    parser.add_argument("package", nargs="*", help="The packages to analyse, or the number of random packages to analyse from index")
+    parser.add_argument("--package-list", help="File with one package to analyse per line")
+    parser.add_argument("--seed", help="Seed of the random sample, the same seed picks the same packages in every tool", default=DEFAULT_SEED)
+    parser.add_argument("--stages", help="Comma-separated analyses to run", default=",".join(STAGES))
+    for stage, limit in DEFAULT_LIMITS.items():
+        parser.add_argument(f"--{stage}-workers", help=f"Number of packages in the {stage} stage at once", type=int, default=limit)
+    parser.add_argument("--max-in-flight", help="Number of fetched packages waiting for or running their analyses (default: twice the analysis workers)", type=int)
+    parser.add_argument("--journal", help="The job journal that runs resume from", default=DEFAULT_JOURNAL)
+    parser.add_argument("--artifact-dir", help="The shared store of downloaded packages", default=DEFAULT_ARTIFACT_DIR)
+    parser.add_argument("--artifact-max-gb", help="Size cap of the shared artifact store in GiB", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3)
+    parser.add_argument("--timing-log", help="JSON Lines file to append the per-stage timing events to", default=DEFAULT_TIMING_LOG)
+    args = parser.parse_args()
+
+    stages = [ x for x in args.stages.split(",") if x ]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"unknown stage {stage}")
+    limits = { stage: getattr(args, f"{stage}_workers") for stage in DEFAULT_LIMITS }
+    max_in_flight = args.max_in_flight or 2 * sum(limits[x] for x in stages)
+
+    if args.package_list is not None:
+        packages = args.package + bandit.read_package_list(args.package_list)
+    elif len(args.package) == 1 and args.package[0].isdigit():
+        logger.info("Fetching package index...")
+        packages = sample_n(iter_projects(INDEX_URL), int(args.package[0]), args.seed)
+    elif len(args.package) > 0:
+        packages = args.package
+    else:
+        parser.error("give one or more packages or --package-list")
+    packages = list(dict.fromkeys(packages))
+
+    store = ArtifactStore(args.artifact_dir, int(args.artifact_max_gb * 1024 ** 3))
+    configure(args, store)
+
+    with Journal(args.journal) as journal:
+        orchestrator = Orchestrator(stages, limits, journal, store, max_in_flight)
+        logger.info(f"Analysing {len(packages)} packages ({', '.join(stages)}), at most {max_in_flight} at once...")
+        try:
+            orchestrator.run(packages)
+        finally:
+            orchestrator.close()
+    logger.info(f"Done: {orchestrator.done} packages, {orchestrator.failed} with failed stages.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+
+from index import normalize
+
+DEFAULT_SHARD_DIR = "./out/shards/"
+MANIFEST_SUFFIX = ".shard.json"
+
+
+def parse_shard(value):
+    """Parse "i/N" into (i, N), for the --shard option of the collection scripts."""
+    try:
+        index, count = ( int(x) for x in value.split("/") )
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..N-1, got {value!r}")
+    return index, count
+
+
+def shard_of(name, count):
+    """Shard of a package among count shards, the same on every node and for every tool."""
+    # Salted, so shards do not line up with the random samples of sampling.py
+    digest = hashlib.sha256(f"shard:{normalize(name)}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def in_shard(name, shard):
+    return shard is None or shard_of(name, shard[1]) == shard[0]
+
+
+def shard_tag(shard):
+    return f"shard-{shard[0]:03d}-of-{shard[1]:03d}"
+
+
+def shard_output_dir(tool, shard, shard_dir=DEFAULT_SHARD_DIR):
+    """Output directory of a tool on one shard, e.g. ./out/shards/shard-002-of-008/bandit/."""
+    return os.path.join(shard_dir, shard_tag(shard), tool)
+
+
+def manifest_path(output_dir):
+    # Next to the output directory, whose entries are all package results
+    return os.path.normpath(output_dir) + MANIFEST_SUFFIX
+
+
+def write_manifest(output_dir, tool, shard, **fields):
+    """Record which tool and shard an output directory holds, and how far the run got.
+
+    Called at the start of a run and again when it is done, so the merge
+    step can tell finished shards from unfinished ones.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    fpath = manifest_path(output_dir)
+    manifest = {}
+    if os.path.exists(fpath):
+        with open(fpath) as f:
+            manifest = json.load(f)
+    manifest.update({
+        "tool": tool,
+        "shard": shard[0],
+        "count": shard[1],
+        "host": platform.node(),
+        "updated_at": datetime.datetime.now().isoformat(),
+    })
+    manifest.update(fields)
+    with open(fpath + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(fpath + ".tmp", fpath)
+
+
+def read_manifest(output_dir):
+    with open(manifest_path(output_dir)) as f:
+        return json.load(f)
@@ -0,0 +1,384 @@
+import struct
+
+# Read captures in large blocks and walk the records in memory instead of
+# issuing one read() per packet
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Port on which tshark dissects a "dns" layer (mDNS and LLMNR get their own layers)
+DNS_PORT = 53
+
+# IP protocols matched by the "tcp or udp or icmp" display filter
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPPROTO_ICMPV6 = 58
+FILTER_PROTOS = (IPPROTO_ICMP, IPPROTO_TCP, IPPROTO_UDP)
+
+# ICMP error messages quote the offending datagram, which tshark dissects too
+ICMP_ERRORS = (3, 4, 5, 11, 12)
+ICMPV6_ERRORS = (1, 2, 3, 4)
+
+# IPv6 extension headers that have to be skipped to reach the transport header
+IPV6_EXT_HEADERS = (0, 43, 60, 135, 139, 140)
+IPPROTO_FRAGMENT = 44
+# Fragmented datagrams waiting for their last fragment, the oldest are
+# dropped beyond this
+MAX_FRAGMENTED = 1024
+
+# Link types produced by tcpdump and friends
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": "<",  # microseconds, little endian
+    b"\xa1\xb2\xc3\xd4": ">",  # microseconds, big endian
+    b"\x4d\x3c\xb2\xa1": "<",  # nanoseconds, little endian
+    b"\xa1\xb2\x3c\x4d": ">",  # nanoseconds, big endian
+}
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_OPB = 0x00000002
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BOM = 0x1A2B3C4D
+
+
+class PcapError(Exception):
+    pass
+
+
+def _read_blocks(f):
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            return
+        yield block
+
+
+def _iter_pcap(f, head):
+    endian = PCAP_MAGIC[head[:4]]
+    header = head + f.read(24 - len(head))
+    if len(header) < 24:
+        raise PcapError("Truncated pcap file header")
+    linktype = struct.unpack(endian + "I", header[20:24])[0] & 0x0FFFFFFF
+    record = struct.Struct(endian + "IIII")
+
+    buf = b""
+    for block in _read_blocks(f):
+        buf = buf + block if buf else block
+        off = 0
+        end = len(buf)
+        while end - off >= 16:
+            _, _, caplen, origlen = record.unpack_from(buf, off)
+            if end - off - 16 < caplen:
+                break
+            yield linktype, origlen, buf[off + 16:off + 16 + caplen]
+            off += 16 + caplen
+        buf = buf[off:]
+    # A trailing partial record means the capture was cut short (e.g. tcpdump
+    # was killed mid-write); tshark ignores it as well
+
+
+def _iter_pcapng(f, head):
+    buf = head
+    endian = "<"
+    linktypes = []
+    snaplens = []
+    blocks = _read_blocks(f)
+    exhausted = False
+    off = 0
+
+    while True:
+        if len(buf) - off < 12 and not exhausted:
+            nxt = next(blocks, None)
+            if nxt is None:
+                exhausted = True
+            else:
+                buf = buf[off:] + nxt
+                off = 0
+            continue
+        if len(buf) - off < 12:
+            return
+
+        btype = struct.unpack_from(endian + "I", buf, off)[0]
+        if btype == PCAPNG_SHB:
+            # The byte order of a section is given by its byte-order magic
+            bom = buf[off + 8:off + 12]
+            endian = "<" if struct.unpack("<I", bom)[0] == PCAPNG_BOM else ">"
+            linktypes = []
+            snaplens = []
+        blen = struct.unpack_from(endian + "I", buf, off + 4)[0]
+        if blen < 12 or blen % 4 != 0:
+            raise PcapError(f"Invalid pcapng block length {blen}")
+        if len(buf) - off < blen:
+            if exhausted:
+                return
+            nxt = next(blocks, None)
+            if nxt is None:
+                exhausted = True
+            else:
+                buf = buf[off:] + nxt
+                off = 0
+            continue
+
+        body = off + 8
+        # Body size, without the type and the two block lengths
+        size = blen - 12
+        if btype == PCAPNG_IDB:
+            if size < 8:
+                raise PcapError(f"Truncated pcapng interface description block of {blen} bytes")
+            linktype, _, snaplen = struct.unpack_from(endian + "HHI", buf, body)
+            linktypes.append(linktype)
+            snaplens.append(snaplen)
+        elif btype == PCAPNG_EPB:
+            if size < 20:
+                raise PcapError(f"Truncated pcapng enhanced packet block of {blen} bytes")
+            ifid, _, _, caplen, origlen = struct.unpack_from(endian + "IIIII", buf, body)
+            if ifid >= len(linktypes):
+                raise PcapError(f"Packet on undeclared pcapng interface {ifid}")
+            if caplen > size - 20:
+                raise PcapError(f"Packet of {caplen} bytes in a pcapng block of {blen} bytes")
+            data = buf[body + 20:body + 20 + caplen]
+            yield linktypes[ifid], origlen, data
+        elif btype == PCAPNG_SPB:
+            if size < 4:
+                raise PcapError(f"Truncated pcapng simple packet block of {blen} bytes")
+            if not linktypes:
+                raise PcapError("Packet before any pcapng interface description")
+            origlen = struct.unpack_from(endian + "I", buf, body)[0]
+            caplen = min(origlen, snaplens[0] or origlen, blen - 16)
+            yield linktypes[0], origlen, buf[body + 4:body + 4 + caplen]
+        elif btype == PCAPNG_OPB:
+            if size < 20:
+                raise PcapError(f"Truncated pcapng packet block of {blen} bytes")
+            ifid, _, _, _, caplen, origlen = struct.unpack_from(endian + "HHIIII", buf, body)
+            if ifid >= len(linktypes):
+                raise PcapError(f"Packet on undeclared pcapng interface {ifid}")
+            if caplen > size - 20:
+                raise PcapError(f"Packet of {caplen} bytes in a pcapng block of {blen} bytes")
+            yield linktypes[ifid], origlen, buf[body + 20:body + 20 + caplen]
+        off += blen
+
+
+def iter_packets(fpath):
+    """Yield (linktype, original length, captured bytes) for every record in a pcap or pcapng file."""
+    with open(fpath, "rb") as f:
+        head = f.read(4)
+        if len(head) < 4:
+            raise PcapError(f"{fpath} is not a capture file")
+        if head in PCAP_MAGIC:
+            yield from _iter_pcap(f, head)
+        elif struct.unpack("<I", head)[0] == PCAPNG_SHB:
+            yield from _iter_pcapng(f, head)
+        else:
+            raise PcapError(f"{fpath} is not a capture file")
+
+
+def _network_layer(linktype, data):
+    """Return (ethertype, offset of the network header), or (None, 0) for non-IP frames."""
+    if linktype == LINKTYPE_ETHERNET:
+        off = 12
+        ethertype = int.from_bytes(data[off:off + 2], "big")
+        off += 2
+        while ethertype in ETHERTYPE_VLAN:
+            ethertype = int.from_bytes(data[off + 2:off + 4], "big")
+            off += 4
+        return ethertype, off
+    if linktype == LINKTYPE_LINUX_SLL:
+        return int.from_bytes(data[14:16], "big"), 16
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return int.from_bytes(data[0:2], "big"), 20
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        version = data[0] >> 4 if data else 0
+        if version == 4:
+            return ETHERTYPE_IPV4, 0
+        if version == 6:
+            return ETHERTYPE_IPV6, 0
+        return None, 0
+    if linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        family = data[0:4]
+        # AF_INET is 2 everywhere, AF_INET6 differs between BSDs and Linux
+        if family in (b"\x02\x00\x00\x00", b"\x00\x00\x00\x02"):
+            return ETHERTYPE_IPV4, 4
+        if len(family) == 4 and (family[0] in (10, 24, 28, 30) or family[3] in (10, 24, 28, 30)):
+            return ETHERTYPE_IPV6, 4
+        return None, 0
+    return None, 0
+
+
+def _reassemble(fragments, key, offset, more, payload):
+    """Add a fragment to the datagram it belongs to, return the whole payload once it is complete.
+
+    Fragments may arrive in any order. Returns None until all of them did,
+    which is never when one was lost or cut by the snaplen.
+    """
+    datagram = fragments.pop(key, None) or {"end": None, "pieces": {}}
+    datagram["pieces"][offset] = payload
+    if not more:
+        datagram["end"] = offset + len(payload)
+    if datagram["end"] is not None:
+        whole = bytearray()
+        for start, piece in sorted(datagram["pieces"].items()):
+            if start > len(whole):
+                break
+            whole += piece[len(whole) - start:]
+        if len(whole) >= datagram["end"]:
+            return bytes(whole[:datagram["end"]])
+    fragments[key] = datagram
+    if len(fragments) > MAX_FRAGMENTED:
+        del fragments[next(iter(fragments))]
+    return None
+
+
+def _transport_layer(ethertype, data, off, fragments=None):
+    """Return (IP protocol, data, offset of the transport header in data), or (None, data, 0).
+
+    Fragments of a datagram are collected in the fragments dict, and the
+    reassembled payload is returned with the fragment that completes it,
+    which is where tshark shows the transport layer. Without a dict (in
+    quoted datagrams), the offset is None for the last fragment.
+    """
+    if ethertype == ETHERTYPE_IPV4:
+        if len(data) < off + 20:
+            return None, data, 0
+        ihl = (data[off] & 0x0F) * 4
+        frag = int.from_bytes(data[off + 6:off + 8], "big")
+        proto = data[off + 9]
+        if frag & 0x3FFF:
+            if fragments is None:
+                return (None, data, 0) if frag & 0x2000 else (proto, data, None)
+            end = off + int.from_bytes(data[off + 2:off + 4], "big")
+            key = (data[off + 12:off + 20], data[off + 4:off + 6], proto)
+            payload = _reassemble(fragments, key, (frag & 0x1FFF) * 8, frag & 0x2000, data[off + ihl:end])
+            return (None, data, 0) if payload is None else (proto, payload, 0)
+        return proto, data, off + ihl
+    if ethertype == ETHERTYPE_IPV6:
+        if len(data) < off + 40:
+            return None, data, 0
+        proto = data[off + 6]
+        addresses = data[off + 8:off + 40]
+        end = off + 40 + int.from_bytes(data[off + 4:off + 6], "big")
+        off += 40
+        while proto in IPV6_EXT_HEADERS or proto == IPPROTO_FRAGMENT:
+            if len(data) < off + 8:
+                return None, data, 0
+            if proto == IPPROTO_FRAGMENT:
+                frag = int.from_bytes(data[off + 2:off + 4], "big")
+                if frag & 0xFFF9:
+                    proto = data[off]
+                    if fragments is None:
+                        return (None, data, 0) if frag & 0x0001 else (proto, data, None)
+                    key = (addresses, data[off + 4:off + 8])
+                    payload = _reassemble(fragments, key, frag & 0xFFF8, frag & 0x0001, data[off + 8:end])
+                    return (None, data, 0) if payload is None else (proto, payload, 0)
+                proto, off = data[off], off + 8
+            else:
+                proto, off = data[off], off + (data[off + 1] + 1) * 8
+        return proto, data, off
+    return None, data, 0
+
+
+def _dns_qname(data, off):
+    """Decode the first question name of the DNS message starting at off, as tshark prints it."""
+    if len(data) < off + 12:
+        return None
+    if int.from_bytes(data[off + 4:off + 6], "big") == 0:
+        return None
+    pos = off + 12
+    labels = []
+    jumps = 0
+    while True:
+        if pos >= len(data):
+            return None
+        length = data[pos]
+        if length == 0:
+            break
+        if length & 0xC0 == 0xC0:
+            if pos + 1 >= len(data) or jumps > 16:
+                return None
+            pos = off + (((length & 0x3F) << 8) | data[pos + 1])
+            jumps += 1
+            continue
+        label = data[pos + 1:pos + 1 + length]
+        if len(label) < length:
+            return None
+        labels.append(label.decode("ascii", errors="replace"))
+        pos += 1 + length
+    if not labels:
+        return "<Root>"
+    return ".".join(labels)
+
+
+def _dns_query(proto, data, off, quoted=False):
+    """Return the DNS query name carried by a transport segment, if any."""
+    if off is None:
+        return None
+    if proto == IPPROTO_UDP:
+        if len(data) < off + 8:
+            return None
+        payload = off + 8
+    elif proto == IPPROTO_TCP:
+        if len(data) < off + 20:
+            return None
+        # DNS over TCP prefixes every message with a two-byte length
+        payload = off + (data[off + 12] >> 4) * 4 + 2
+    elif proto in (IPPROTO_ICMP, IPPROTO_ICMPV6) and not quoted:
+        if len(data) < off + 8:
+            return None
+        if proto == IPPROTO_ICMP and data[off] in ICMP_ERRORS:
+            ethertype = ETHERTYPE_IPV4
+        elif proto == IPPROTO_ICMPV6 and data[off] in ICMPV6_ERRORS:
+            ethertype = ETHERTYPE_IPV6
+        else:
+            return None
+        inner_proto, inner_data, inner_off = _transport_layer(ethertype, data, off + 8)
+        return _dns_query(inner_proto, inner_data, inner_off, quoted=True)
+    else:
+        return None
+
+    sport = int.from_bytes(data[off:off + 2], "big")
+    dport = int.from_bytes(data[off + 2:off + 4], "big")
+    if sport != DNS_PORT and dport != DNS_PORT:
+        return None
+    return _dns_qname(data, payload)
+
+
+def summarize(fpath):
+    """Count the TCP/UDP/ICMP packets of a capture, their total frame size and the DNS query names in one pass.
+
+    This mirrors what tshark reports for the "tcp or udp or icmp" and "dns" display filters.
+    """
+    packets = 0
+    size = 0
+    domains = []
+    fragments = {}
+    try:
+        for linktype, origlen, data in iter_packets(fpath):
+            ethertype, off = _network_layer(linktype, data)
+            if ethertype is None:
+                continue
+            proto, data, off = _transport_layer(ethertype, data, off, fragments)
+            if proto in FILTER_PROTOS:
+                packets += 1
+                size += origlen
+            qname = _dns_query(proto, data, off)
+            if qname is not None:
+                domains.append(qname)
+    except struct.error as e:
+        raise PcapError(f"Malformed capture {fpath}: {e}")
+
+    return {
+        "packets": packets,
+        "size": size,
+        "domains": domains,
+    }
@@ -2,79 +2,217 @@ import json
 import os
 import os.path
 import shutil
-import pyshark
-import random
 import multiprocessing
 import tqdm
 import json
+import argparse
+import pcap
+from manifest import Manifest, MISSING, DEFAULT_MANIFEST
+from shards import open_writer, iter_records, set_aside, remove_shards
+from store import ResultStore, DEFAULT_STORE
+from sampling import sample_n, DEFAULT_SEED
+
+try:
+    import pyshark
+except ImportError:
+    pyshark = None
 
 GUARDDOG_RESULTS = './out/guarddog/'
 BANDIT_RESULTS = './out/bandit/'
 DYNAMIC_RESULTS = './out/dynamic/'
 OUTDIR = './results/'
-NUM_THREADS = 32
+# Number of parsing processes, defaults to one per core
+NUM_WORKERS = os.cpu_count() or 1
+MAX_CHUNKSIZE = 256
+# "native" reads the pcaps in-process, "pyshark" goes through tshark, "check"
+# runs both and reports any mismatch
+DYNAMIC_ENGINE = "native"
+# "jsonl" writes sharded, gzip-compressed JSON Lines, "json" a single JSON object per file
+OUTPUT_FORMAT = "jsonl"
+# Seed of the sampled variants, shared with the collection scripts so the
+# same seed picks the same packages everywhere
+SAMPLE_SEED = DEFAULT_SEED
+# Fields kept per Bandit issue and per GuardDog hit: the code snippets and
+# links make up most of a report and are not used by the analysis
+BANDIT_ISSUE_FIELDS = ("test_id", "test_name", "issue_severity", "issue_confidence", "issue_cwe", "issue_text", "filename", "line_number")
+GUARDDOG_HIT_FIELDS = ("location", "message")
 
-def process_guarddog(sample=0.1):
-    package_findings = {}
-    fds = os.listdir(GUARDDOG_RESULTS)
-    
+def list_packages(input_dir, suffix=""):
+    # Bandit stores one <package>_report.json file per package, the other tools one directory
+    return [ x[:-len(suffix)] if suffix and x.endswith(suffix) else x for x in os.listdir(input_dir) ]
+
+def select_packages(pnames, sample, max_missing=None):
     if isinstance(sample, float) or isinstance(sample, int):
-        ssize = int(sample * len(fds))
         assert sample > 0
-        assert ssize > 0
-        random.shuffle(fds)
-        fds = fds[:ssize]
+        # The collection scripts sample the lowest priorities with the same
+        # seed, so a fixed priority cut would keep nearly all of their data:
+        # keep the lowest share of what was collected instead
+        return sample_n(pnames, int(sample * len(pnames)), SAMPLE_SEED)
     elif isinstance(sample, list):
-        pnames = [ x.split("_logs.txt")[0] for x in fds ]
         missing = set(sample).difference(set(pnames))
-        fds = set(pnames).intersection(set(sample))
-        assert len(missing) < 1000
+        selected = set(pnames).intersection(set(sample))
+        if max_missing is not None:
+            assert len(missing) < max_missing
         if len(missing) > 0:
-            print(f"Missing data for {len(missing)} packages, processing {len(fds)}/{len(sample)} packages")
+            print(f"Missing data for {len(missing)} packages, processing {len(selected)}/{len(sample)} packages")
             print(missing)
+        return list(selected)
+    else:
+        assert False
 
-    i = 0
-    for fd in fds:
-        i += 1
-        if not os.path.isdir(os.path.join(GUARDDOG_RESULTS, fd)):
-            continue
-        with open(os.path.join(GUARDDOG_RESULTS, fd, 'logs.txt'), 'r') as f:
-            data = f.read()
-            if "[Errno 28] No space left on device" in data:
-                print(f"Skipping {fd} due to space error")
-                continue
-            data = "\n".join([ x for x in data.split("\n") if x.startswith("{") ])
-            if len(data) == 0:
-                print(f"Skipping {fd} due to empty data")
-                continue
-            data = json.loads(data)
-        issues = data["issues"]
-
-        c_issues = 0
-        if "results" not in data:
-            # print(f"Skipping {fd} due to missing results: {data['errors']}")
-            continue
-        for item in data["results"].values():
-            if item is None:
-                continue
-            if not isinstance(item, dict) and not isinstance(item, list):
-                c_issues += 1
-                continue
-            c_issues += len(item)
-
-        assert c_issues == issues
-        pname = fd
-        package_findings[pname] = {
-            "issues": issues,
-            "results": data["results"]
-        }
-        if i % 10000 == 0:
-            print(f"Processed {i}/{len(fds)} PyPI packages")
+def open_variants(prefix, pnames, toplist, top10k, max_missing=None):
+    # Decide up front which packages go into which variant, so every record
+    # can be routed to its outputs as soon as it is parsed
+    variants = [
+        ("all", None),
+        ("top1k", toplist),
+        ("top10k", top10k),
+        ("10pct_sample", 0.1),
+    ]
+    writers = []
+    for name, sample in variants:
+        members = None if sample is None else set(select_packages(pnames, sample, max_missing))
+        writers.append((f"{prefix}_{name}", members, open_writer(OUTDIR, f"{prefix}_{name}", OUTPUT_FORMAT)))
+    return writers
+
+def write_variants(writers, pname, record):
+    for _, members, writer in writers:
+        if members is None or pname in members:
+            writer.write(pname, record)
+
+def variant_sink(writers, store_add=None):
+    def sink(pname, record):
+        write_variants(writers, pname, record)
+        if store_add is not None:
+            store_add(pname, record)
+    return sink
+
+def close_variants(writers):
+    for name, _, writer in writers:
+        writer.close()
+        print(f"Wrote {writer.count} packages to {name}")
+
+def process_guarddog(sample=0.1, input_dir=GUARDDOG_RESULTS, pnames=None, manifest=None, sink=None, previous=None):
+    if pnames is None:
+        pnames = list_packages(input_dir)
+    fds = select_packages(pnames, sample, max_missing=1000)
+
+    processing_queue = [ (fd, os.path.join(input_dir, fd, 'logs.txt')) for fd in fds ]
+    package_findings, stats = parse_all("guarddog", guarddog_worker, processing_queue, manifest=manifest, sink=sink, previous=previous)
     print("PyPI GuardDog data processed successfully")
-    print(f"Found {sum([x['issues'] for x in package_findings.values()])} issues in PyPI packages")
-    print(f"Found {len(package_findings)} PyPI packages")
+    print(f"Found {stats['issues']} issues in PyPI packages")
+    print(f"Found {stats['packages']} PyPI packages")
     return package_findings
 
+def guarddog_worker(t):
+    fd, fpath = t
+    if not os.path.isfile(fpath):
+        return None
+    with open(fpath, 'r') as f:
+        data = f.read()
+        if "[Errno 28] No space left on device" in data:
+            print(f"Skipping {fd} due to space error")
+            return None
+        data = "\n".join([ x for x in data.split("\n") if x.startswith("{") ])
+        if len(data) == 0:
+            print(f"Skipping {fd} due to empty data")
+            return None
+        data = json.loads(data)
+    issues = data["issues"]
+
+    c_issues = 0
+    if "results" not in data:
+        # print(f"Skipping {fd} due to missing results: {data['errors']}")
+        return None
+    for item in data["results"].values():
+        if item is None:
+            continue
+        if not isinstance(item, dict) and not isinstance(item, list):
+            c_issues += 1
+            continue
+        c_issues += len(item)
+
+    assert c_issues == issues
+    results = {}
+    for rule, item in data["results"].items():
+        if isinstance(item, list):
+            item = [ { k: x[k] for k in GUARDDOG_HIT_FIELDS if k in x } if isinstance(x, dict) else x for x in item ]
+        results[rule] = item
+    return {
+        "issues": issues,
+        "results": results
+    }
+
+def parse_all(tool, worker, processing_queue, manifest=None, npaths=1, sink=None, previous=None):
+    """Run worker over (pname, *fpaths, ...) tuples on a process pool and return ({pname: record}, stats).
+
+    With a manifest, only tasks whose first npaths files are new or changed
+    are parsed. The manifest only keeps a summary of the others, their
+    records are read from previous, the (pname, record) pairs written by the
+    last run, and parsed again when missing there.
+    With a sink, every record is passed to sink(pname, record) as soon as it
+    is available instead of being collected in the returned dict.
+    """
+    package_findings = {}
+    stats = {"packages": 0, "issues": 0}
+    stamps = {}
+
+    def emit(pname, res):
+        stats["packages"] += 1
+        stats["issues"] += res.get("issues", 0)
+        if sink is None:
+            package_findings[pname] = res
+        else:
+            sink(pname, res)
+
+    if manifest is not None:
+        queue = []
+        cached = {}
+        for t in processing_queue:
+            pname = t[0]
+            stamps[pname] = manifest.stamp(*t[1:1 + npaths])
+            res = manifest.get(tool, pname, stamps[pname])
+            if res is MISSING:
+                queue.append(t)
+            elif res is not None:
+                cached[pname] = t
+        if len(cached) > 0 and previous is not None:
+            try:
+                for pname, res in previous:
+                    if cached.pop(pname, None) is not None:
+                        emit(pname, res)
+            except (OSError, EOFError, ValueError) as e:
+                # Shards cut short by an interrupted run
+                print(f"Stopped reading the previous results: {e}")
+        queue += cached.values()
+        print(f"Reusing {len(processing_queue) - len(queue)} cached results, processing {len(queue)} packages")
+        processing_queue = queue
+
+    if len(processing_queue) == 0:
+        return package_findings, stats
+
+    # Hand out tasks in chunks so cheap parses are not dominated by IPC
+    chunksize = max(1, min(MAX_CHUNKSIZE, len(processing_queue) // (NUM_WORKERS * 4)))
+    # imap_unordered queues up results without any backpressure, so submit a
+    # bounded window at a time to keep a slow sink from buffering everything
+    window = NUM_WORKERS * chunksize * 8
+    with multiprocessing.Pool(NUM_WORKERS) as pool, tqdm.tqdm(total=len(processing_queue)) as progress:
+        for start in range(0, len(processing_queue), window):
+            tasks = [ (worker, t) for t in processing_queue[start:start + window] ]
+            for pname, fpath, res in pool.imap_unordered(pool_task, tasks, chunksize=chunksize):
+                progress.update()
+                if manifest is not None:
+                    manifest.put(tool, pname, fpath, stamps[pname], None if res is None else {"issues": res.get("issues", 0)})
+                if res is None:
+                    continue
+                emit(pname, res)
+    return package_findings, stats
+
+def pool_task(t):
+    # imap_unordered returns results in completion order, so carry the name along
+    worker, args = t
+    return args[0], args[1], worker(args)
+
 def process_pypi_stats():
     with open('./data/pypi_stats.csv', 'r') as f:
         data = f.read().split("\n")
@@ -93,70 +231,41 @@ def pypi_get_top(n=100):
     pypi_stats = sorted(pypi_stats.items(), key=lambda x: x[1], reverse=True)
     return [x[0] for x in pypi_stats[:n]]
 
-def process_bandit(sample=0.1, input_dir=BANDIT_RESULTS):
-    package_findings = {}
-    fds = os.listdir(input_dir)
-    i = 0
-
-    if isinstance(sample, float) or isinstance(sample, int):
-        ssize = int(sample * len(fds))
-        assert sample > 0
-        assert ssize > 0
-        random.shuffle(fds)
-        fds = fds[:ssize]
-    elif isinstance(sample, list):
-        pnames = [ x.split("_report.json")[0] for x in fds ]
-        missing = set(sample).difference(set(pnames))
-        fds = set(pnames).intersection(set(sample))
-        fds = [ x + "_report.json" for x in fds ]
-        if len(missing) > 0:
-            print(f"Missing data for {len(missing)} packages, processing {len(fds)}/{len(sample)} packages")
-            print(missing)
-    
-    for fname in fds:
-        i += 1
-        with open(os.path.join(input_dir, fname), 'r') as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                print(f"Skipping {fname} due to JSON error")
-                continue
-        pname = fname.split("_report.json")[0]
-        summary = data["metrics"]["_totals"]
-        results = data["results"]
-        issues_check = len(results)
-        issues = sum([ v for k, v in summary.items() if k.startswith("SEVERITY") ])
-        assert issues_check == issues
-        package_findings[pname] = {
-            "issues": issues,
-            "summary": summary,
-            "results": results
-        }
-        if i % 10000 == 0:
-            print(f"Processed {i}/{len(fds)} PyPI packages")
+def process_bandit(sample=0.1, input_dir=BANDIT_RESULTS, pnames=None, manifest=None, sink=None, previous=None):
+    if pnames is None:
+        pnames = list_packages(input_dir, suffix="_report.json")
+    fds = select_packages(pnames, sample)
+    processing_queue = [ (pname, os.path.join(input_dir, pname + "_report.json")) for pname in fds ]
+    package_findings, stats = parse_all("bandit", bandit_worker, processing_queue, manifest=manifest, sink=sink, previous=previous)
     print("PyPI Bandit data processed successfully")
-    print(f"Found {sum([x['issues'] for x in package_findings.values()])} issues in PyPI packages")
-    print(f"Found {len(package_findings)} PyPI packages")
+    print(f"Found {stats['issues']} issues in PyPI packages")
+    print(f"Found {stats['packages']} PyPI packages")
     return package_findings
 
-def process_dynamic(sample=0.1, input_dir=DYNAMIC_RESULTS):
-    package_findings = {}
-    fds = os.listdir(input_dir)
+def bandit_worker(t):
+    pname, fpath = t
+    with open(fpath, 'r') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Skipping {os.path.basename(fpath)} due to JSON error")
+            return None
+    summary = data["metrics"]["_totals"]
+    results = data["results"]
+    issues_check = len(results)
+    issues = sum([ v for k, v in summary.items() if k.startswith("SEVERITY") ])
+    assert issues_check == issues
+    return {
+        "issues": issues,
+        "summary": summary,
+        "results": [ { k: x[k] for k in BANDIT_ISSUE_FIELDS if k in x } for x in results ]
+    }
 
-    if isinstance(sample, float) or isinstance(sample, int):
-        ssize = int(sample * len(fds))
-        assert sample > 0
-        assert ssize > 0
-        random.shuffle(fds)
-        fds = fds[:ssize]
-    elif isinstance(sample, list):
-        missing = set(sample).difference(set(fds))
-        fds = set(fds).intersection(set(sample))
-        if len(missing) > 0:
-            print(f"Missing data for {len(missing)} packages, processing {len(fds)}/{len(sample)} packages")
-            print(missing)
-    else:
-        assert False
+def process_dynamic(sample=0.1, input_dir=DYNAMIC_RESULTS, engine=None, pnames=None, manifest=None, sink=None, previous=None):
+    engine = engine or DYNAMIC_ENGINE
+    if pnames is None:
+        pnames = list_packages(input_dir)
+    fds = select_packages(pnames, sample)
 
     processing_queue = []
     for e in fds:
@@ -167,31 +276,82 @@ def process_dynamic(sample=0.1, input_dir=DYNAMIC_RESULTS):
         
         fpath_package = os.path.join(input_dir, pname, 'package.pcap')
         fpath_dependencies = os.path.join(input_dir, pname, 'dependencies.pcap')
-        processing_queue.append((pname, fpath_package, fpath_dependencies))
+        fpath_summary = os.path.join(input_dir, pname, 'summary.json')
+        if os.path.isfile(fpath_summary):
+            # Summarized in the worker container (dynamic.py --summary), the
+            # captures are cut to a few hundred bytes per packet if present
+            processing_queue.append((pname, fpath_summary, fpath_dependencies, "summary"))
+        else:
+            processing_queue.append((pname, fpath_package, fpath_dependencies, engine))
 
-    with multiprocessing.Pool(NUM_THREADS) as pool:
-        res = tqdm.tqdm(pool.imap_unordered(dynamic_worker, processing_queue), total=len(processing_queue))
-        for pname, res in zip(fds, res):
-            if res is None:
-                continue
-            package_findings[pname] = res
+    package_findings, stats = parse_all(f"dynamic-{engine}", dynamic_worker, processing_queue, manifest=manifest, npaths=2, sink=sink, previous=previous)
 
     print("PyPI Dynamic data processed successfully")
-    print(f"Found {len(package_findings)} PyPI packages")
+    print(f"Found {stats['packages']} PyPI packages")
     return package_findings
 
 def dynamic_worker(t):
-    pname, fpath_package, fpath_dependencies = t
+    pname, fpath_package, fpath_dependencies = t[:3]
+    engine = t[3] if len(t) > 3 else DYNAMIC_ENGINE
+
+    if engine == "summary":
+        return dynamic_worker_summary(pname, fpath_package)
+    if engine == "native":
+        return dynamic_worker_native(pname, fpath_package, fpath_dependencies)
+    if engine == "pyshark":
+        return dynamic_worker_pyshark(pname, fpath_package, fpath_dependencies)
+    if engine == "check":
+        res = dynamic_worker_native(pname, fpath_package, fpath_dependencies)
+        ref = dynamic_worker_pyshark(pname, fpath_package, fpath_dependencies)
+        if res != ref:
+            diff = [ k for k in (res or ref) if res is None or ref is None or res[k] != ref[k] ]
+            print(f"Engine mismatch for {pname} on {diff}")
+        return res
+    raise ValueError(f"Unknown dynamic engine {engine}")
+
+def dynamic_worker_summary(pname, fpath_summary):
+    with open(fpath_summary, 'r') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            print(f"Skipping {pname} due to JSON error")
+            return None
+
+def dynamic_worker_native(pname, fpath_package, fpath_dependencies):
+    try:
+        package = pcap.summarize(fpath_package)
+        dependencies = pcap.summarize(fpath_dependencies)
+    except FileNotFoundError:
+        print(f"Skipping {pname} due to missing pcap")
+        return None
+    except pcap.PcapError as e:
+        print(f"Skipping {pname} due to invalid pcap: {e}")
+        return None
+
+    res = {
+        "packets": package["packets"],
+        "dep_packets": dependencies["packets"],
+        "packets_size": package["size"],
+        "dep_packets_size": dependencies["size"],
+        "packets_domains": package["domains"],
+        "dep_packets_domains": dependencies["domains"],
+    }
+
+    return res
+
+def dynamic_worker_pyshark(pname, fpath_package, fpath_dependencies):
+    if pyshark is None:
+        raise RuntimeError("pyshark is not installed, use the native engine")
+
     PCAP_FILTER = "tcp or udp or icmp"
     PCAP_FILTER_DNS = "dns"
 
-    num_packets = 0
-    num_dep_packets = 0
-    packets_size = 0
-    dep_packets_size = 0
-
     attempt = 0
     while True:
+        num_packets = 0
+        num_dep_packets = 0
+        packets_size = 0
+        dep_packets_size = 0
         try:
             with pyshark.FileCapture(fpath_package, display_filter=PCAP_FILTER) as cap:
                 for x in cap:
@@ -233,6 +393,22 @@ def dynamic_worker(t):
     return res
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", help="How to read the dynamic analysis pcaps", choices=["native", "pyshark", "check"], default=DYNAMIC_ENGINE)
+    parser.add_argument("--manifest", help="Cache of parsed per-file summaries reused across runs", default=DEFAULT_MANIFEST)
+    parser.add_argument("--no-manifest", help="Parse every file again instead of reusing cached summaries", action="store_true")
+    parser.add_argument("--workers", help="Number of parsing processes", type=int, default=NUM_WORKERS)
+    parser.add_argument("--format", help="Output format of the processed results", choices=["jsonl", "json"], default=OUTPUT_FORMAT)
+    parser.add_argument("--seed", help="Seed of the sampled variants, the same seed picks the same packages in every tool", type=int, default=SAMPLE_SEED)
+    parser.add_argument("--sqlite", help="Also write an indexed SQLite store for query.py", nargs="?", const=DEFAULT_STORE, default=None)
+    args = parser.parse_args()
+    OUTPUT_FORMAT = args.format
+    DYNAMIC_ENGINE = args.engine
+    NUM_WORKERS = args.workers
+    SAMPLE_SEED = args.seed
+    manifest = None if args.no_manifest else Manifest(args.manifest)
+    store = None if args.sqlite is None else ResultStore(args.sqlite)
+
     if not os.path.exists(OUTDIR):
         os.makedirs(OUTDIR)
     
@@ -242,52 +418,36 @@ if __name__ == "__main__":
     top10k = pypi_get_top(10000)
     with open(os.path.join(OUTDIR, "top10k.json"), 'w') as f:
         json.dump(top10k, f)
+    if store is not None:
+        store.add_downloads(process_pypi_stats())
 
-    pypi_bandit_all = process_bandit(sample=1)
-    with open(os.path.join(OUTDIR, "bandit_all.json"), 'w') as f:
-        json.dump(pypi_bandit_all, f)
-    
-    dynamic_all = process_dynamic(sample=1)
-    with open(os.path.join(OUTDIR, "dynamic_all.json"), 'w') as f:
-        json.dump(dynamic_all, f)
+    # Parse every tool's results once and stream each record to the variants
+    # (all, top-N and sampled) it belongs to, so memory stays bounded. The
+    # records of unchanged files are read back from the last run's shards.
+    previous = { prefix: set_aside(OUTDIR, f"{prefix}_all") for prefix in ["bandit", "dynamic", "gd"] }
 
-    gd_pypi = process_guarddog(sample=1)
-    with open(os.path.join(OUTDIR, "gd_all.json"), 'w') as f:
-        json.dump(gd_pypi, f)
+    bandit_pnames = list_packages(BANDIT_RESULTS, suffix="_report.json")
+    writers = open_variants("bandit", bandit_pnames, toplist, top10k)
+    process_bandit(sample=1, pnames=bandit_pnames, manifest=manifest, sink=variant_sink(writers, store and store.add_bandit), previous=iter_records(OUTDIR, previous["bandit"]))
+    close_variants(writers)
 
-    gd_pypi = process_guarddog(sample=toplist)
-    with open(os.path.join(OUTDIR, "gd_top1k.json"), 'w') as f:
-        json.dump(gd_pypi, f)
+    dynamic_pnames = list_packages(DYNAMIC_RESULTS)
+    writers = open_variants("dynamic", dynamic_pnames, toplist, top10k)
+    process_dynamic(sample=1, pnames=dynamic_pnames, manifest=manifest, sink=variant_sink(writers, store and store.add_dynamic), previous=iter_records(OUTDIR, previous["dynamic"]))
+    close_variants(writers)
 
-    gd_pypi = process_guarddog(sample=top10k)
-    with open(os.path.join(OUTDIR, "gd_top10k.json"), 'w') as f:
-        json.dump(gd_pypi, f)
-    
-    gd_pypi = process_guarddog(sample=0.1)
-    with open(os.path.join(OUTDIR, "gd_10pct_sample.json"), 'w') as f:
-        json.dump(gd_pypi, f)
-    
-    bandit_10pct_sample = process_bandit(sample=0.1)
-    with open(os.path.join(OUTDIR, "bandit_10pct_sample.json"), 'w') as f:
-        json.dump(bandit_10pct_sample, f)
-    
-    bandit_top1k = process_bandit(sample=toplist)
-    with open(os.path.join(OUTDIR, "bandit_top1k.json"), 'w') as f:
-        json.dump(bandit_top1k, f)
-    
-    bandit_top10k = process_bandit(sample=top10k)
-    with open(os.path.join(OUTDIR, "bandit_top10k.json"), 'w') as f:
-        json.dump(bandit_top10k, f)
-    
-    dynamic_top1k = process_dynamic(sample=toplist)
-    with open(os.path.join(OUTDIR, "dynamic_top1k.json"), 'w') as f:
-        json.dump(dynamic_top1k, f)
-    
-    dynamic_top10k = process_dynamic(sample=top10k)
-    with open(os.path.join(OUTDIR, "dynamic_top10k.json"), 'w') as f:
-        json.dump(dynamic_top10k, f)
-    
-    dynamic_10pct_sample = process_dynamic(sample=0.1)
-    with open(os.path.join(OUTDIR, "dynamic_10pct_sample.json"), 'w') as f:
-        json.dump(dynamic_10pct_sample, f)
+    gd_pnames = list_packages(GUARDDOG_RESULTS)
+    writers = open_variants("gd", gd_pnames, toplist, top10k, max_missing=1000)
+    process_guarddog(sample=1, pnames=gd_pnames, manifest=manifest, sink=variant_sink(writers, store and store.add_guarddog), previous=iter_records(OUTDIR, previous["gd"]))
+    close_variants(writers)
+
+    for prefix in previous.values():
+        remove_shards(OUTDIR, prefix)
+
+    if store is not None:
+        store.close()
+        print(f"Wrote SQLite store to {store.path}")
 
+    if manifest is not None:
+        print(f"Manifest: reused {manifest.hits} cached summaries, parsed {manifest.misses} new or changed files")
+        manifest.close()
@@ -0,0 +1,113 @@
+import argparse
+import sqlite3
+import sys
+
+from store import DEFAULT_STORE, reverse_domain
+
+
+def top_filter(column, top):
+    # Restrict a query to the N most downloaded packages
+    if top is None:
+        return "", []
+    return f" AND {column} IN (SELECT name FROM packages WHERE rank <= ?)", [top]
+
+
+def query_bandit(conn, args):
+    where, params = top_filter("package", args.top)
+    sql = f"SELECT package, COUNT(*) FROM bandit_issues WHERE test_id = ?{where}"
+    params = [args.test_id] + params
+    if args.severity:
+        sql += " AND severity = ?"
+        params.append(args.severity.upper())
+    if args.confidence:
+        sql += " AND confidence = ?"
+        params.append(args.confidence.upper())
+    sql += " GROUP BY package ORDER BY COUNT(*) DESC, package"
+    return ["package", "issues"], conn.execute(sql, params)
+
+
+def query_domain(conn, args):
+    rdomain = reverse_domain(args.domain)
+    if args.subdomains:
+        # "." sorts right before "/", so this range is every name under the domain
+        cond, params = "rdomain >= ? AND rdomain < ?", [rdomain, rdomain[:-1] + "/"]
+    else:
+        cond, params = "rdomain = ?", [rdomain]
+    where, extra = top_filter("package", args.top)
+    sql = f"SELECT package, phase, domain, COUNT(*) FROM dns_queries WHERE {cond}{where}"
+    params += extra
+    if args.phase:
+        sql += " AND phase = ?"
+        params.append(args.phase)
+    sql += " GROUP BY package, phase, domain ORDER BY package, phase, domain"
+    return ["package", "phase", "domain", "queries"], conn.execute(sql, params)
+
+
+def query_guarddog(conn, args):
+    where, params = top_filter("package", args.top)
+    sql = f"SELECT package, hits FROM guarddog_hits WHERE rule = ?{where} ORDER BY hits DESC, package"
+    return ["package", "hits"], conn.execute(sql, [args.rule] + params)
+
+
+def query_rules(conn, args):
+    where, params = top_filter("package", args.top)
+    if args.tool == "bandit":
+        sql = f"SELECT test_id, test_name, COUNT(DISTINCT package), COUNT(*) FROM bandit_issues WHERE 1{where} GROUP BY test_id ORDER BY COUNT(DISTINCT package) DESC"
+        return ["test_id", "test_name", "packages", "issues"], conn.execute(sql, params)
+    sql = f"SELECT rule, COUNT(*), SUM(hits) FROM guarddog_hits WHERE 1{where} GROUP BY rule ORDER BY COUNT(*) DESC"
+    return ["rule", "packages", "hits"], conn.execute(sql, params)
+
+
+def query_sql(conn, args):
+    cur = conn.execute(args.statement)
+    return [ x[0] for x in cur.description or [] ], cur
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the SQLite store written by process.py --sqlite")
+    parser.add_argument("--db", help="The result store to query", default=DEFAULT_STORE)
+    parser.add_argument("--limit", help="Print at most this many rows", type=int, default=None)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("bandit", help="Packages that trigger a Bandit test, e.g. B602")
+    p.add_argument("test_id")
+    p.add_argument("--severity", help="Only issues of this severity")
+    p.add_argument("--confidence", help="Only issues of this confidence")
+    p.add_argument("--top", help="Only the N most downloaded packages", type=int)
+    p.set_defaults(func=query_bandit)
+
+    p = subparsers.add_parser("domain", help="Packages that resolve a domain at install time")
+    p.add_argument("domain")
+    p.add_argument("--subdomains", help="Also match subdomains of the domain", action="store_true")
+    p.add_argument("--phase", help="Only queries of this install phase", choices=["package", "dependencies"])
+    p.add_argument("--top", help="Only the N most downloaded packages", type=int)
+    p.set_defaults(func=query_domain)
+
+    p = subparsers.add_parser("guarddog", help="Packages that hit a GuardDog rule, e.g. shady-links")
+    p.add_argument("rule")
+    p.add_argument("--top", help="Only the N most downloaded packages", type=int)
+    p.set_defaults(func=query_guarddog)
+
+    p = subparsers.add_parser("rules", help="Number of packages per Bandit test or GuardDog rule")
+    p.add_argument("tool", choices=["bandit", "guarddog"])
+    p.add_argument("--top", help="Only the N most downloaded packages", type=int)
+    p.set_defaults(func=query_rules)
+
+    p = subparsers.add_parser("sql", help="Run an arbitrary read-only SQL statement")
+    p.add_argument("statement")
+    p.set_defaults(func=query_sql)
+
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    header, rows = args.func(conn, args)
+    print("\t".join(header))
+    for i, row in enumerate(rows):
+        if args.limit is not None and i >= args.limit:
+            break
+        print("\t".join("" if x is None else str(x) for x in row))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
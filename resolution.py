@@ -0,0 +1,150 @@
+import json
+import os
+import re
+import sqlite3
+import time
+
+DEFAULT_RESOLUTION_DIR = "./cache/rcache/"
+# Metadata of an exact (project, version) pin does not change once published
+METADATA_TTL = 30 * 24 * 3600
+# New releases change what a bare name resolves to and which versions exist
+VERSIONS_TTL = 24 * 3600
+LOCK_TTL = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    requirement TEXT NOT NULL,
+    index_url TEXT NOT NULL,
+    pre INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    requires TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (requirement, index_url, pre)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT NOT NULL,
+    index_url TEXT NOT NULL,
+    pre INTEGER NOT NULL,
+    available TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (name, index_url, pre)
+);
+CREATE TABLE IF NOT EXISTS locks (
+    requirement TEXT NOT NULL,
+    index_url TEXT NOT NULL,
+    lock TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (requirement, index_url)
+);
+"""
+
+PINNED_RE = re.compile(r"^[A-Za-z0-9._-]+(\[[^\]]*\])?==[^,;<>!~=*]+$")
+
+
+class ResolutionCache:
+    """Persistent cache of pipgrip dependency metadata and solved lockfiles.
+
+    Per-requirement metadata (resolved version and its requirements) is kept
+    for METADATA_TTL when the requirement is an exact pin and VERSIONS_TTL
+    otherwise; the list of available versions of a project and whole
+    lockfiles expire after VERSIONS_TTL and LOCK_TTL.
+    """
+
+    def __init__(self, root=DEFAULT_RESOLUTION_DIR):
+        self.root = os.path.abspath(root)
+        # pip's own HTTP and wheel cache, so metadata that does have to be
+        # fetched again does not rebuild the same sdists
+        self.pip_cache_dir = os.path.join(self.root, "pip")
+        os.makedirs(self.pip_cache_dir, exist_ok=True)
+        self.db_path = os.path.join(self.root, "resolution.db")
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # One short-lived connection per operation, so the cache can be used
+        # from several threads and processes at once
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get_metadata(self, requirement, index_url, pre):
+        ttl = METADATA_TTL if PINNED_RE.match(requirement) else VERSIONS_TTL
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT name, version, requires FROM metadata WHERE requirement = ? AND index_url = ? AND pre = ? AND fetched_at >= ?",
+                (requirement, index_url or "", bool(pre), time.time() - ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"name": row[0], "version": row[1], "requires": json.loads(row[2])}
+
+    def put_metadata(self, requirement, index_url, pre, info):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO metadata (requirement, index_url, pre, name, version, requires, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (requirement, index_url or "", bool(pre), info["name"], info["version"], json.dumps(info["requires"]), time.time()),
+            )
+
+    def get_versions(self, name, index_url, pre):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT available FROM versions WHERE name = ? AND index_url = ? AND pre = ? AND fetched_at >= ?",
+                (name.lower(), index_url or "", bool(pre), time.time() - VERSIONS_TTL),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_versions(self, name, index_url, pre, available):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO versions (name, index_url, pre, available, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (name.lower(), index_url or "", bool(pre), json.dumps(available), time.time()),
+            )
+
+    def get_lock(self, requirement, index_url):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT lock FROM locks WHERE requirement = ? AND index_url = ? AND fetched_at >= ?",
+                (requirement, index_url or "", time.time() - LOCK_TTL),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_lock(self, requirement, index_url, lock):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO locks (requirement, index_url, lock, fetched_at) VALUES (?, ?, ?, ?)",
+                (requirement, index_url or "", json.dumps(lock), time.time()),
+            )
+
+    def wrap_discover(self, discover, get_available_versions, parse_req):
+        """Wrap pipgrip.pipper.discover_dependencies_and_versions with this cache."""
+
+        def cached_discover(package, index_url, extra_index_url, cache_dir, pre, no_cache_dir=False):
+            info = self.get_metadata(package, index_url, pre)
+            if info is None:
+                res = discover(package, index_url, extra_index_url, cache_dir, pre, no_cache_dir)
+                self.put_metadata(package, index_url, pre, res)
+                req = parse_req(package)
+                if req.key != "." and req.url is None:
+                    self.put_versions(req.name, index_url, pre, res["available"])
+                return res
+
+            req = parse_req(package)
+            if req.key == "." or req.url is not None:
+                available = [info["version"]]
+            else:
+                available = self.get_versions(req.name, index_url, pre)
+                if available is None:
+                    available = get_available_versions(req.name, index_url, extra_index_url, pre)
+                    self.put_versions(req.name, index_url, pre, available)
+            available = list(available)
+            if info["version"] not in available:
+                available.append(info["version"])
+            return {
+                "name": info["name"],
+                "version": info["version"],
+                "available": available,
+                "requires": info["requires"],
+            }
+
+        return cached_discover
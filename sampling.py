@@ -0,0 +1,35 @@
+import hashlib
+import heapq
+
+from index import normalize
+
+# Same seed, same packages: every tool that samples with it picks a package
+# or not regardless of which other packages it sees
+DEFAULT_SEED = 0
+
+
+def priority(name, seed=DEFAULT_SEED):
+    """Pseudo-random number in [0, 1) derived from the seed and the normalized package name."""
+    digest = hashlib.sha256(f"{seed}:{normalize(name)}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def sample_n(names, n, seed=DEFAULT_SEED):
+    """Return the n names with the lowest priority in one pass and O(n) memory.
+
+    The result is in priority order, which is a random order. With n None,
+    every name is returned in that order, with n 0 or less none.
+    """
+    if n is None:
+        return [ x for _, x in sorted((priority(x, seed), x) for x in names) ]
+    if n <= 0:
+        return []
+    # Max-heap of the n lowest priorities seen so far
+    heap = []
+    for x in names:
+        p = priority(x, seed)
+        if len(heap) < n:
+            heapq.heappush(heap, (-p, x))
+        elif -heap[0][0] > p:
+            heapq.heapreplace(heap, (-p, x))
+    return [ x for _, x in sorted((-p, x) for p, x in heap) ]
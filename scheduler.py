@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+
+logger = logging.getLogger()
+
+# Concurrency starts at MIN_WORKERS and grows by one every RAMP_INTERVAL
+# seconds while the host stays healthy and every slot is busy
+MIN_WORKERS = 1
+MAX_WORKERS = os.cpu_count() or 1
+RAMP_INTERVAL = 20
+PROBE_INTERVAL = 5
+# Pressure thresholds: no new packages are started while any is exceeded
+MAX_LOAD_PER_CPU = 1.0
+MIN_FREE_MEMORY = 2 * 1024 ** 3
+MIN_FREE_DISK = 10 * 1024 ** 3
+# Seconds with no package allowed to start (a full disk) before the run gives up
+MAX_STALL = 30 * 60
+
+
+def memory_available():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+class AdaptiveScheduler:
+    """Run a task over a list of items with concurrency driven by live host resources.
+
+    The number of running tasks ramps up while load, free memory, free disk
+    and the number of running containers stay within their limits, and no new
+    task is started (backpressure) while any of them is exceeded. Queue and
+    run time of every item are logged and appended to stats_path as JSON Lines,
+    with the outcome returned by the task ("ok" when it returns None). When
+    no task may start for max_stall seconds, the items left are recorded as
+    "aborted" and run() raises RuntimeError.
+    """
+
+    def __init__(self, task, min_workers=MIN_WORKERS, max_workers=MAX_WORKERS, disk_paths=(".",), count_containers=None, stats_path=None, max_stall=MAX_STALL):
+        self.task = task
+        self.min_workers = min_workers
+        self.max_workers = max(min_workers, max_workers)
+        self.disk_paths = disk_paths
+        self.count_containers = count_containers
+        self.stats_path = stats_path
+        self.max_stall = max_stall
+        self.target = min_workers
+        self.running = 0
+        self.done = False
+        self.last_change = 0
+        self.stalled_since = None
+        self.aborted = None
+        self.aborted_items = 0
+        self.cond = threading.Condition()
+        self.stats_lock = threading.Lock()
+        self.queue = queue.Queue()
+
+    def probe(self):
+        """Return (resource, reason) for every limit exceeded right now."""
+        reasons = []
+        cpus = os.cpu_count() or 1
+        load = os.getloadavg()[0]
+        if load > MAX_LOAD_PER_CPU * cpus:
+            reasons.append(("load", f"load {load:.1f} on {cpus} CPUs"))
+        mem = memory_available()
+        if mem is not None and mem < MIN_FREE_MEMORY:
+            reasons.append(("memory", f"{mem / 1024 ** 3:.1f} GiB memory available"))
+        for path in self.disk_paths:
+            free = shutil.disk_usage(path).free
+            if free < MIN_FREE_DISK:
+                reasons.append(("disk", f"{free / 1024 ** 3:.1f} GiB free on {path}"))
+        if self.count_containers is not None:
+            containers = self.count_containers()
+            if containers > self.max_workers:
+                reasons.append(("containers", f"{containers} containers running"))
+        return reasons
+
+    def _control(self):
+        while not self.done:
+            try:
+                reasons = self.probe()
+            except Exception:
+                logger.error("Resource probe failed:")
+                logger.error(traceback.format_exc())
+                reasons = []
+            now = time.time()
+            with self.cond:
+                if reasons:
+                    target = max(self.min_workers, self.running - 1)
+                    if any(resource == "disk" for resource, _ in reasons):
+                        # A full disk fails every package, so stop starting any
+                        target = 0
+                    if target < self.target:
+                        logger.warning(f"Throttling to {target} concurrent packages: {', '.join(x for _, x in reasons)}")
+                        self.target = target
+                        self.last_change = now
+                    if self.target == 0:
+                        if self.stalled_since is None:
+                            self.stalled_since = now
+                        elif now - self.stalled_since >= self.max_stall and self.aborted is None:
+                            self.aborted = f"no package could start for {now - self.stalled_since:.0f}s: {', '.join(x for _, x in reasons)}"
+                            logger.error(f"Giving up, {self.aborted}")
+                elif self.target < self.min_workers:
+                    self.target = self.min_workers
+                    self.last_change = now
+                    self.stalled_since = None
+                elif self.running >= self.target and self.target < self.max_workers and now - self.last_change >= RAMP_INTERVAL:
+                    self.target += 1
+                    self.last_change = now
+                    logger.info(f"Ramping up to {self.target} concurrent packages")
+                self.cond.notify_all()
+            time.sleep(PROBE_INTERVAL)
+
+    def _record(self, item, queued_at, started_at, ended_at, outcome):
+        stats = {
+            "package": item,
+            "queue_time": round(started_at - queued_at, 3),
+            "run_time": round(ended_at - started_at, 3),
+            "outcome": outcome,
+            "concurrency": self.target,
+        }
+        logger.info(f"{item}: queued {stats['queue_time']:.1f}s, ran {stats['run_time']:.1f}s ({outcome})")
+        if self.stats_path is not None:
+            with self.stats_lock, open(self.stats_path, "a") as f:
+                f.write(json.dumps(stats) + "\n")
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while self.running >= self.target and self.aborted is None:
+                    self.cond.wait(PROBE_INTERVAL)
+                try:
+                    item, queued_at = self.queue.get_nowait()
+                except queue.Empty:
+                    return
+                aborted = self.aborted is not None
+                if aborted:
+                    self.aborted_items += 1
+                else:
+                    self.running += 1
+
+            if aborted:
+                now = time.time()
+                self._record(item, queued_at, now, now, "aborted")
+                continue
+
+            started_at = time.time()
+            try:
+                outcome = self.task(item) or "ok"
+            except Exception:
+                outcome = "error"
+                logger.error(f"Failed to process {item}:")
+                logger.error(traceback.format_exc())
+            finally:
+                with self.cond:
+                    self.running -= 1
+                    self.cond.notify_all()
+                self._record(item, queued_at, started_at, time.time(), outcome)
+
+    def run(self, items):
+        now = time.time()
+        for item in items:
+            self.queue.put((item, now))
+
+        controller = threading.Thread(target=self._control, daemon=True)
+        controller.start()
+        workers = [ threading.Thread(target=self._work, daemon=True) for _ in range(self.max_workers) ]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        self.done = True
+        controller.join()
+        if self.aborted_items > 0:
+            raise RuntimeError(f"Gave up on {self.aborted_items} packages, {self.aborted}")
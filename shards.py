@@ -0,0 +1,106 @@
+import glob
+import gzip
+import json
+import os
+
+# Number of packages per compressed JSON Lines shard
+SHARD_SIZE = 10000
+
+
+class ShardedJsonlWriter:
+    """Stream one {"package": name, ...} record per line into <prefix>-NNNNN.jsonl.gz shards."""
+
+    def __init__(self, outdir, prefix, shard_size=SHARD_SIZE):
+        self.outdir = outdir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.shard = 0
+        self.count = 0
+        self.f = None
+        # Drop shards of a previous, larger run so they are not read back
+        remove_shards(outdir, prefix)
+
+    def _open_next(self):
+        if self.f is not None:
+            self.f.close()
+        fpath = os.path.join(self.outdir, f"{self.prefix}-{self.shard:05d}.jsonl.gz")
+        self.f = gzip.open(fpath, "wt", encoding="utf-8")
+        self.shard += 1
+
+    def write(self, pname, record):
+        if self.count % self.shard_size == 0:
+            self._open_next()
+        self.f.write(json.dumps({"package": pname, **record}))
+        self.f.write("\n")
+        self.count += 1
+
+    def close(self):
+        if self.f is None:
+            # Keep an empty shard so readers can tell "no packages" from "not run"
+            self._open_next()
+        self.f.close()
+
+
+class JsonObjectWriter:
+    """Stream records into a single <prefix>.json object, as json.dump of the full dict would write it."""
+
+    def __init__(self, outdir, prefix):
+        self.f = open(os.path.join(outdir, f"{prefix}.json"), "w")
+        self.f.write("{")
+        self.count = 0
+
+    def write(self, pname, record):
+        if self.count > 0:
+            self.f.write(", ")
+        self.f.write(json.dumps(pname))
+        self.f.write(": ")
+        self.f.write(json.dumps(record))
+        self.count += 1
+
+    def close(self):
+        self.f.write("}")
+        self.f.close()
+
+
+def open_writer(outdir, prefix, fmt="jsonl"):
+    if fmt == "jsonl":
+        return ShardedJsonlWriter(outdir, prefix)
+    if fmt == "json":
+        return JsonObjectWriter(outdir, prefix)
+    raise ValueError(f"Unknown output format {fmt}")
+
+
+def shard_paths(outdir, prefix):
+    return sorted(glob.glob(os.path.join(glob.escape(outdir), f"{glob.escape(prefix)}-[0-9][0-9][0-9][0-9][0-9].jsonl.gz")))
+
+
+def remove_shards(outdir, prefix):
+    for fpath in shard_paths(outdir, prefix):
+        os.remove(fpath)
+
+
+def set_aside(outdir, prefix, suffix=".previous"):
+    """Rename the shards of prefix to prefix + suffix, so they can still be read while prefix is written again.
+
+    Shards set aside before are dropped first. Returns the new prefix.
+    """
+    remove_shards(outdir, prefix + suffix)
+    for fpath in shard_paths(outdir, prefix):
+        # <prefix>-NNNNN.jsonl.gz -> <prefix><suffix>-NNNNN.jsonl.gz
+        fname = os.path.basename(fpath)
+        os.rename(fpath, os.path.join(outdir, prefix + suffix + fname[len(prefix):]))
+    return prefix + suffix
+
+
+def iter_records(outdir, prefix):
+    """Yield (package, record) pairs from the shards written for prefix."""
+    for fpath in shard_paths(outdir, prefix):
+        with gzip.open(fpath, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                yield record.pop("package"), record
+
+
+def load_results(outdir, prefix):
+    """Load sharded results back into the {package: record} dict the analysis notebook expects."""
+    return dict(iter_records(outdir, prefix))
@@ -1,17 +1,15 @@
-import requests
-
-DEFAULT_INDEX_URL = "https://pypi.org/simple/"
-
-def fetch_index():
-    response = requests.get(DEFAULT_INDEX_URL)
-    response.raise_for_status()
-    for l in response.text.split("\n"):
-        if l.startswith('<a href="/simple/'):
-            pkgname = l.split("/")[2]
-            yield pkgname
+import argparse
+from index import iter_projects, DEFAULT_INDEX_URL, DEFAULT_INDEX_CACHE_DIR, MAX_AGE
 
 def main():
-    for pkg in fetch_index():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-url", help="The index URL, or a local mirror, to list packages from", default=DEFAULT_INDEX_URL)
+    parser.add_argument("--index-cache-dir", help="The directory of the local copy of the index", default=DEFAULT_INDEX_CACHE_DIR)
+    parser.add_argument("--refresh", help="Revalidate the local copy of the index even if it is recent", action="store_true")
+    args = parser.parse_args()
+
+    max_age = 0 if args.refresh else MAX_AGE
+    for pkg in iter_projects(args.index_url, args.index_cache_dir, max_age):
         print(pkg)
 
 if __name__ == "__main__":
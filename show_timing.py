@@ -0,0 +1,33 @@
+import argparse
+import sys
+
+from timing import DEFAULT_TIMING_LOG, aggregate, read_events, report_rows, write_prometheus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency report of the timing events of the collection scripts")
+    parser.add_argument("logs", nargs="*", help="Timing logs to aggregate", default=[DEFAULT_TIMING_LOG])
+    parser.add_argument("--tool", help="Only the stages of this tool", choices=["bandit", "guarddog", "dynamic", "worker"])
+    parser.add_argument("--since", help="Only events that started at or after this Unix time", type=float)
+    parser.add_argument("--prometheus", help="Also write the metrics to this file in the Prometheus text format")
+    args = parser.parse_args()
+
+    events = ( e for fpath in args.logs for e in read_events(fpath) )
+    if args.tool is not None:
+        events = ( e for e in events if e.get("tool") == args.tool )
+    if args.since is not None:
+        events = ( e for e in events if e["start"] >= args.since )
+    stats = aggregate(events)
+
+    if args.prometheus is not None:
+        write_prometheus(stats, args.prometheus)
+
+    header, rows = report_rows(stats)
+    print("\t".join(header))
+    for row in rows:
+        print("\t".join("" if x is None else f"{x:.3f}" if isinstance(x, float) else str(x) for x in row))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+
+DEFAULT_STORE = "./results/results.db"
+# Number of packages inserted before committing
+COMMIT_EVERY = 5000
+
+SCHEMA = """
+CREATE TABLE packages (
+    name TEXT PRIMARY KEY,
+    downloads INTEGER,
+    rank INTEGER
+);
+CREATE TABLE bandit_packages (
+    package TEXT PRIMARY KEY,
+    issues INTEGER NOT NULL,
+    loc INTEGER,
+    summary TEXT
+);
+CREATE TABLE bandit_issues (
+    package TEXT NOT NULL,
+    test_id TEXT,
+    test_name TEXT,
+    severity TEXT,
+    confidence TEXT,
+    cwe INTEGER,
+    filename TEXT,
+    line_number INTEGER
+);
+CREATE TABLE guarddog_packages (
+    package TEXT PRIMARY KEY,
+    issues INTEGER NOT NULL
+);
+CREATE TABLE guarddog_hits (
+    package TEXT NOT NULL,
+    rule TEXT NOT NULL,
+    hits INTEGER NOT NULL,
+    detail TEXT
+);
+CREATE TABLE dynamic_packages (
+    package TEXT PRIMARY KEY,
+    packets INTEGER,
+    dep_packets INTEGER,
+    packets_size INTEGER,
+    dep_packets_size INTEGER
+);
+CREATE TABLE dns_queries (
+    package TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    rdomain TEXT NOT NULL
+);
+"""
+
+# Created after the bulk load, which is much faster than maintaining them row by row
+INDEXES = """
+CREATE INDEX IF NOT EXISTS packages_rank ON packages (rank);
+CREATE INDEX IF NOT EXISTS bandit_issues_test_id ON bandit_issues (test_id, package);
+CREATE INDEX IF NOT EXISTS bandit_issues_package ON bandit_issues (package);
+CREATE INDEX IF NOT EXISTS bandit_issues_severity ON bandit_issues (severity, confidence);
+CREATE INDEX IF NOT EXISTS guarddog_hits_rule ON guarddog_hits (rule, package);
+CREATE INDEX IF NOT EXISTS guarddog_hits_package ON guarddog_hits (package);
+CREATE INDEX IF NOT EXISTS dns_queries_rdomain ON dns_queries (rdomain, package);
+CREATE INDEX IF NOT EXISTS dns_queries_package ON dns_queries (package);
+"""
+
+
+def reverse_domain(domain):
+    # "files.pythonhosted.org" -> "org.pythonhosted.files." so that all
+    # subdomains of a name share an indexable prefix
+    return ".".join(reversed(domain.lower().rstrip(".").split("."))) + "."
+
+
+class ResultStore:
+    """Normalized SQLite copy of the processed results.
+
+    The database is built in a temporary file and moved into place on
+    close(), so readers never see a half-written store.
+    """
+
+    def __init__(self, path=DEFAULT_STORE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.conn = sqlite3.connect(self.tmp_path)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.executescript(SCHEMA)
+        self.pending = 0
+
+    def _inserted(self):
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.conn.commit()
+            self.pending = 0
+
+    def add_downloads(self, pypi_stats):
+        ranked = sorted(pypi_stats.items(), key=lambda x: x[1], reverse=True)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO packages (name, downloads, rank) VALUES (?, ?, ?)",
+            [ (name, downloads, rank + 1) for rank, (name, downloads) in enumerate(ranked) ],
+        )
+        self.conn.commit()
+
+    def _add_package(self, pname):
+        self.conn.execute("INSERT OR IGNORE INTO packages (name) VALUES (?)", (pname,))
+
+    def add_bandit(self, pname, record):
+        self._add_package(pname)
+        summary = record["summary"]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO bandit_packages (package, issues, loc, summary) VALUES (?, ?, ?, ?)",
+            (pname, record["issues"], summary.get("loc"), json.dumps(summary)),
+        )
+        self.conn.executemany(
+            "INSERT INTO bandit_issues (package, test_id, test_name, severity, confidence, cwe, filename, line_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    pname,
+                    x.get("test_id"),
+                    x.get("test_name"),
+                    x.get("issue_severity"),
+                    x.get("issue_confidence"),
+                    (x.get("issue_cwe") or {}).get("id"),
+                    x.get("filename"),
+                    x.get("line_number"),
+                )
+                for x in record["results"]
+            ],
+        )
+        self._inserted()
+
+    def add_guarddog(self, pname, record):
+        self._add_package(pname)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO guarddog_packages (package, issues) VALUES (?, ?)",
+            (pname, record["issues"]),
+        )
+        hits = []
+        for rule, item in record["results"].items():
+            # Same counting as process.guarddog_worker's consistency check
+            if item is None:
+                continue
+            if not isinstance(item, dict) and not isinstance(item, list):
+                hits.append((pname, rule, 1, json.dumps(item)))
+            elif len(item) > 0:
+                hits.append((pname, rule, len(item), json.dumps(item)))
+        self.conn.executemany(
+            "INSERT INTO guarddog_hits (package, rule, hits, detail) VALUES (?, ?, ?, ?)",
+            hits,
+        )
+        self._inserted()
+
+    def add_dynamic(self, pname, record):
+        self._add_package(pname)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO dynamic_packages (package, packets, dep_packets, packets_size, dep_packets_size) VALUES (?, ?, ?, ?, ?)",
+            (pname, record["packets"], record["dep_packets"], record["packets_size"], record["dep_packets_size"]),
+        )
+        queries = [ (pname, "package", x, reverse_domain(x)) for x in record["packets_domains"] ]
+        queries += [ (pname, "dependencies", x, reverse_domain(x)) for x in record["dep_packets_domains"] ]
+        self.conn.executemany(
+            "INSERT INTO dns_queries (package, phase, domain, rdomain) VALUES (?, ?, ?, ?)",
+            queries,
+        )
+        self._inserted()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.executescript(INDEXES)
+        self.conn.execute("ANALYZE")
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.tmp_path, self.path)
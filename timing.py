@@ -0,0 +1,162 @@
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+DEFAULT_TIMING_LOG = "./log/timing.jsonl"
+PERCENTILES = [50, 90, 99]
+METRIC_PREFIX = "rep_pkg_stage"
+
+
+class TimingLog:
+    """JSON Lines stream of per-stage timing events.
+
+    Every event is one line with the tool, package, stage, start (Unix time),
+    duration (seconds), bytes (or null) and outcome ("ok" or "error"). Each
+    event is written with a single append, so the threads and processes of a
+    run can share one file.
+    """
+
+    def __init__(self, path=DEFAULT_TIMING_LOG, tool=None):
+        self.path = path
+        self.tool = tool
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def emit(self, package, stage, start, duration, bytes=None, outcome="ok"):
+        self.write_lines([json.dumps({
+            "tool": self.tool,
+            "package": package,
+            "stage": stage,
+            "start": start,
+            "duration": duration,
+            "bytes": bytes,
+            "outcome": outcome,
+        }) + "\n"])
+
+    def write_lines(self, lines):
+        with open(self.path, "a") as f:
+            f.write("".join(lines))
+
+    @contextlib.contextmanager
+    def stage(self, package, stage, bytes=None):
+        """Time the body of a with block, which can set event["bytes"] and event["outcome"]."""
+        event = {"bytes": bytes, "outcome": "ok"}
+        start = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield event
+        except BaseException:
+            event["outcome"] = "error"
+            raise
+        finally:
+            self.emit(package, stage, start, time.perf_counter() - t0, event["bytes"], event["outcome"])
+
+    def merge(self, fpath):
+        """Append the events another TimingLog wrote to fpath, e.g. inside a container."""
+        if not os.path.exists(fpath):
+            return
+        with open(fpath) as f:
+            self.write_lines([ l if l.endswith("\n") else l + "\n" for l in f if l.strip() ])
+
+
+def tree_size(path):
+    """Total size in bytes of a file or of the files under a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for fname in files:
+            fpath = os.path.join(root, fname)
+            if not os.path.islink(fpath):
+                total += os.path.getsize(fpath)
+    return total
+
+
+def read_events(fpath):
+    with open(fpath) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Last line of a run that was killed while writing it
+                continue
+
+
+def percentile(values, p):
+    """Percentile of sorted values, interpolating between the closest ranks."""
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def aggregate(events):
+    """Group events by (tool, stage) into durations, byte and outcome counts."""
+    stats = {}
+    for e in events:
+        s = stats.setdefault((e.get("tool") or "", e["stage"]), {"durations": [], "bytes": 0, "outcomes": {}})
+        s["durations"].append(e["duration"])
+        s["bytes"] += e.get("bytes") or 0
+        s["outcomes"][e["outcome"]] = s["outcomes"].get(e["outcome"], 0) + 1
+    for s in stats.values():
+        s["durations"].sort()
+    return stats
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def prometheus_text(stats):
+    """Render aggregated stats in the Prometheus text exposition format."""
+    lines = [
+        f"# HELP {METRIC_PREFIX}_duration_seconds Duration of the stages of the collection scripts.",
+        f"# TYPE {METRIC_PREFIX}_duration_seconds summary",
+    ]
+    for (tool, stage), s in sorted(stats.items()):
+        labels = f'tool="{escape_label(tool)}",stage="{escape_label(stage)}"'
+        for p in PERCENTILES:
+            lines.append(f'{METRIC_PREFIX}_duration_seconds{{{labels},quantile="{p / 100}"}} {percentile(s["durations"], p)}')
+        lines.append(f"{METRIC_PREFIX}_duration_seconds_sum{{{labels}}} {sum(s['durations'])}")
+        lines.append(f"{METRIC_PREFIX}_duration_seconds_count{{{labels}}} {len(s['durations'])}")
+    lines += [
+        f"# HELP {METRIC_PREFIX}_bytes_total Bytes processed by the stages of the collection scripts.",
+        f"# TYPE {METRIC_PREFIX}_bytes_total counter",
+    ]
+    for (tool, stage), s in sorted(stats.items()):
+        lines.append(f'{METRIC_PREFIX}_bytes_total{{tool="{escape_label(tool)}",stage="{escape_label(stage)}"}} {s["bytes"]}')
+    lines += [
+        f"# HELP {METRIC_PREFIX}_events_total Stages run by the collection scripts, by outcome.",
+        f"# TYPE {METRIC_PREFIX}_events_total counter",
+    ]
+    for (tool, stage), s in sorted(stats.items()):
+        for outcome, n in sorted(s["outcomes"].items()):
+            lines.append(f'{METRIC_PREFIX}_events_total{{tool="{escape_label(tool)}",stage="{escape_label(stage)}",outcome="{escape_label(outcome)}"}} {n}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(stats, fpath):
+    # Replaced in one step, as the node_exporter textfile collector expects
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fpath)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(prometheus_text(stats))
+        os.replace(tmp_path, fpath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def report_rows(stats):
+    """Per-stage rows of the latency report, slowest total time first."""
+    rows = []
+    for (tool, stage), s in stats.items():
+        d = s["durations"]
+        errors = sum(n for outcome, n in s["outcomes"].items() if outcome != "ok")
+        rows.append([tool, stage, len(d), errors, sum(d)] + [ percentile(d, p) for p in PERCENTILES ] + [d[-1], s["bytes"]])
+    rows.sort(key=lambda x: x[4], reverse=True)
+    return ["tool", "stage", "count", "errors", "total_s"] + [ f"p{p}_s" for p in PERCENTILES ] + ["max_s", "bytes"], rows
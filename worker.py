@@ -1,25 +1,138 @@
+import json
+import os
 import subprocess
+import time
+import traceback
+
+from timing import TimingLog
 
 PIP_TIMEOUT = 600
+GO_FILE = "/app/out/go"
+# Read back and merged into the host timing log by dynamic.py
+TIMING_FILE = "/app/out/timing.jsonl"
+# Outcome of the dependency install, dynamic.py only caches the dependency
+# capture of a successful one
+DEPENDENCY_OUTCOME_FILE = "/app/out/dependency_outcome.txt"
+
+def wait_for_go():
+    # Started ahead of time by dynamic.WarmPool: wait until a package has been
+    # handed over, along with the settings specific to it
+    while not os.path.exists(GO_FILE):
+        time.sleep(0.05)
+    with open(GO_FILE) as f:
+        os.environ.update(json.load(f))
+
+if os.environ.get("WAIT_FOR_GO") == "1":
+    wait_for_go()
+
+# Summary mode: capture only packet headers, summarize the captures here and
+# ship the capture files only for packages that query a domain outside the
+# allowlist. The files kept are cut at SNAPLEN bytes per packet too.
+SUMMARY_MODE = os.environ.get("SUMMARY_MODE") == "1"
+SNAPLEN = os.environ.get("SNAPLEN", "512")
+DOMAIN_ALLOWLIST = [ x.lower().rstrip(".") for x in os.environ.get("DOMAIN_ALLOWLIST", "").split(",") if x ]
+# Install the dependencies without capturing them, their capture is reused
+# from another package with the same pinned dependencies
+SKIP_DEPENDENCY_CAPTURE = os.environ.get("SKIP_DEPENDENCY_CAPTURE") == "1"
+# Domains of the reused dependency capture, which count for keeping the captures
+DEPENDENCY_DOMAINS = [ x for x in os.environ.get("DEPENDENCY_DOMAINS", "").split(",") if x ]
+
+with open("/app/out/pkg_only.txt") as f:
+    PACKAGE = f.read().strip()
+timing = TimingLog(TIMING_FILE, "worker")
+
+def pip_install(stage, requirements):
+    with timing.stage(PACKAGE, stage) as event:
+        try:
+            result = subprocess.run(["pip", "install", "--no-build-isolation", "-r", requirements, "--find-links", "/app/cache", "--no-index"], timeout=PIP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            event["outcome"] = "timeout"
+            raise
+        if result.returncode != 0:
+            event["outcome"] = "error"
+    return event["outcome"]
+
+def start_tcpdump(fpath):
+    # Launch tcpdump with no write buffer
+    cmd = ["tcpdump", "-U", "-i", "any", "-w", fpath]
+    if SUMMARY_MODE:
+        cmd[1:1] = ["-s", SNAPLEN]
+    return subprocess.Popen(cmd)
 
-# Launch tcpdump with no write buffer
-tcpdump_process = subprocess.Popen(["tcpdump", "-U", "-i", "any", "-w", "/app/dependencies.pcap"])
+def is_allowed(domain):
+    domain = domain.lower().rstrip(".")
+    return any(domain == x or domain.endswith("." + x) for x in DOMAIN_ALLOWLIST)
+
+def write_summary():
+    import pcap
+
+    package = pcap.summarize("/app/package.pcap")
+    domains = package["domains"]
+    if SKIP_DEPENDENCY_CAPTURE:
+        domains = domains + DEPENDENCY_DOMAINS
+        # The dependency fields are filled in by dynamic.py
+        summary = {
+            "packets": package["packets"],
+            "packets_size": package["size"],
+            "packets_domains": package["domains"],
+        }
+    else:
+        dependencies = pcap.summarize("/app/dependencies.pcap")
+        domains = domains + dependencies["domains"]
+        # Same fields as process.dynamic_worker
+        summary = {
+            "packets": package["packets"],
+            "dep_packets": dependencies["packets"],
+            "packets_size": package["size"],
+            "dep_packets_size": dependencies["size"],
+            "packets_domains": package["domains"],
+            "dep_packets_domains": dependencies["domains"],
+        }
+    with open("/app/out/summary.json", "w") as f:
+        json.dump(summary, f)
+
+    unlisted = sorted(set(x for x in domains if not is_allowed(x)))
+    if unlisted:
+        print(f"Keeping capture files, queried domains outside the allowlist: {', '.join(unlisted)}")
+    return len(unlisted) > 0
+
+if not SKIP_DEPENDENCY_CAPTURE:
+    tcpdump_process = start_tcpdump("/app/dependencies.pcap")
 
 # Run "pip install -r pkg_requirements.txt --find-links /app/cache"
-subprocess.run(["pip", "install", "--no-build-isolation", "-r", "/app/out/pkg_requirements.txt", "--find-links", "/app/cache", "--no-index"], timeout=PIP_TIMEOUT)
+outcome = pip_install("dependency_install", "/app/out/pkg_requirements.txt")
+with open(DEPENDENCY_OUTCOME_FILE, "w") as f:
+    f.write(outcome)
 
 # Gracefully restart tcpdump with a new capture file
-tcpdump_process.terminate()
-tcpdump_process.wait()
-tcpdump_process = subprocess.Popen(["tcpdump", "-U", "-i", "any", "-w", "/app/package.pcap"])
+if not SKIP_DEPENDENCY_CAPTURE:
+    tcpdump_process.terminate()
+    tcpdump_process.wait()
+tcpdump_process = start_tcpdump("/app/package.pcap")
 
 # Run "pip install -r pkg_only.txt --find-links /app/cache"
-subprocess.run(["pip", "install", "--no-build-isolation", "-r", "/app/out/pkg_only.txt", "--find-links", "/app/cache", "--no-index"], timeout=PIP_TIMEOUT)
+pip_install("package_install", "/app/out/pkg_only.txt")
 
 # Stop tcpdump
 tcpdump_process.terminate()
 tcpdump_process.wait()
 
 # Copy the capture files to the volume in /app/cache
-subprocess.run(["cp", "/app/dependencies.pcap", "/app/out/dependencies.pcap"])
-subprocess.run(["cp", "/app/package.pcap", "/app/out/package.pcap"])
\ No newline at end of file
+keep_captures = True
+if SUMMARY_MODE:
+    try:
+        with timing.stage(PACKAGE, "summary"):
+            keep_captures = write_summary()
+    except Exception:
+        # Ship the captures instead, process.py reads them when there is no summary
+        traceback.print_exc()
+        keep_captures = True
+if keep_captures:
+    with timing.stage(PACKAGE, "capture_copy") as event:
+        event["bytes"] = 0
+        fnames = ["package.pcap"] if SKIP_DEPENDENCY_CAPTURE else ["dependencies.pcap", "package.pcap"]
+        for fname in fnames:
+            subprocess.run(["cp", os.path.join("/app", fname), os.path.join("/app/out", fname)])
+            # tcpdump may not have written the capture, or cp may have failed
+            if os.path.exists(os.path.join("/app/out", fname)):
+                event["bytes"] += os.path.getsize(os.path.join("/app/out", fname))